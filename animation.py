@@ -0,0 +1,89 @@
+import logging
+import math
+import time
+
+
+# easing curves map linear progress (0.0 - 1.0) to eased progress (0.0 - 1.0)
+def linear(t):
+    return t
+
+
+def easeInOutQuad(t):
+    if t < 0.5:
+        return 2 * t * t
+    return 1 - ((-2 * t + 2) ** 2) / 2
+
+
+def easeInOutCubic(t):
+    if t < 0.5:
+        return 4 * t * t * t
+    return 1 - ((-2 * t + 2) ** 3) / 2
+
+
+def easeOutCubic(t):
+    return 1 - ((1 - t) ** 3)
+
+
+def easeInOutSine(t):
+    return -(math.cos(math.pi * t) - 1) / 2
+
+
+easings = {
+    "linear": linear,
+    "easeInOutQuad": easeInOutQuad,
+    "easeInOutCubic": easeInOutCubic,
+    "easeOutCubic": easeOutCubic,
+    "easeInOutSine": easeInOutSine,
+}
+
+
+class Animation:
+    # time-based animation driven by the monotonic clock. iterate over
+    # frames() to get the eased progress for each frame to draw. if drawing
+    # falls behind, frames are dropped rather than stretching the animation,
+    # so a transition always takes (about) the same time on any machine.
+    def __init__(self, duration, fps, easing="linear"):
+        self.duration = max(float(duration), 0.0)
+        self.fps = max(float(fps), 1.0)
+        self.easing = easings.get(easing)
+        if self.easing is None:
+            logging.warning("Unknown animation easing %s, using linear", easing)
+            self.easing = linear
+        self.framesDrawn = 0
+        self.framesDropped = 0
+        self.elapsed = 0.0
+
+    def frames(self):
+        frameTime = 1.0 / self.fps
+        targetFrames = max(int(round(self.duration * self.fps)), 1)
+        start = time.monotonic()
+        frame = 0
+        while frame < targetFrames:
+            progress = min((time.monotonic() - start) / self.duration, 1.0) \
+                if self.duration > 0 else 1.0
+            if progress >= 1.0:
+                break
+            yield self.easing(progress)
+            self.framesDrawn += 1
+            # figure out which frame slot we're in now; anything we skipped is dropped
+            now = time.monotonic()
+            nextFrame = int((now - start) / frameTime) + 1
+            if nextFrame > frame + 1:
+                self.framesDropped += nextFrame - (frame + 1)
+            frame = nextFrame
+            delay = start + (frame * frameTime) - now
+            if delay > 0:
+                time.sleep(delay)
+        # always finish on the final frame
+        yield self.easing(1.0)
+        self.framesDrawn += 1
+        self.elapsed = time.monotonic() - start
+
+    def achievedFPS(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.framesDrawn / self.elapsed
+
+    def report(self):
+        return ("%d frames in %.3fs (%.1f fps achieved, %.1f fps target, %d dropped)" %
+                (self.framesDrawn, self.elapsed, self.achievedFPS(), self.fps, self.framesDropped))
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+import logging
+import os
+import pygame
+import configuration
+from textcache import fontLock, surfaceBytes
+
+cfg = configuration.cfg
+
+
+class AssetManager:
+    # images and fonts from disk, shared by every tile. images are keyed by
+    # (path, size, filter, alpha), so tiles asking for the same icon at the
+    # same size share one decoded, scaled surface, and different sizes
+    # share one decode. images are kept in an LRU bounded by the total size
+    # of the pixel data; surfaces handed out are shared, so callers must
+    # only blit from them (or copy them). fonts are few, and elsewhere are
+    # used as cache keys (text surfaces, the clock's glyph atlas), so they're
+    # never evicted. each asset is tagged with a class ("background",
+    # "icon", "font", ...) for reporting.
+    def __init__(self, maxBytes, workers=4):
+        self.maxBytes = maxBytes
+        self.workers = workers
+        self.images = OrderedDict()  # key -> (surface, bytes, assetClass)
+        self.imageBytes = 0
+        self.fonts = {}  # (name, size) -> (font, bytes)
+        self.loading = {}  # key -> Future, so concurrent requests share one load
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def image(self, path, size=None, filter="smooth", alpha=False, assetClass="image"):
+        key = (path, tuple(size) if size is not None else None, filter if size is not None else None, alpha)
+        with self.lock:
+            entry = self.images.get(key)
+            if entry is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            future = self.loading.get(key)
+            loader = future is None
+            if loader:
+                future = Future()
+                self.loading[key] = future
+        if not loader:
+            # someone else is already loading it
+            return future.result()
+        try:
+            if size is None:
+                surface = pygame.image.load(path)
+                surface = surface.convert_alpha() if alpha else surface.convert()
+            else:
+                source = self.image(path, alpha=alpha, assetClass=assetClass)
+                if filter == "fast":
+                    surface = pygame.transform.scale(source, size)
+                else:
+                    surface = pygame.transform.smoothscale(source, size)
+        except Exception as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.store(key, surface, assetClass)
+        future.set_result(surface)
+        return surface
+
+    def store(self, key, surface, assetClass):
+        size = surfaceBytes(surface)
+        if size > self.maxBytes:
+            return
+        self.images[key] = (surface, size, assetClass)
+        self.imageBytes += size
+        while self.imageBytes > self.maxBytes:
+            oldKey, (oldSurface, oldSize, oldClass) = self.images.popitem(last=False)
+            self.imageBytes -= oldSize
+
+    def font(self, name, size):
+        key = (name, size)
+        with self.lock:
+            entry = self.fonts.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            # fonts load quickly, so just hold the lock; that also makes sure
+            # there's only ever one Font object for a name and size
+            path = "fonts/" + name + ".ttf"
+            with fontLock:
+                font = pygame.font.Font(path, size)
+            self.fonts[key] = (font, os.path.getsize(path))
+            return font
+
+    def preload(self, images=(), fonts=()):
+        # start loading declared assets in parallel and return right away;
+        # anyone who asks for one that's still loading waits for it.
+        # images are dicts of image() arguments, fonts are (name, size).
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="assets")
+
+        def load(function, *args, **kwargs):
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                logging.warning("Couldn't preload asset %s %s", args, kwargs, exc_info=True)
+
+        for name, size in set(fonts):
+            executor.submit(load, self.font, name, size)
+        for image in images:
+            executor.submit(load, self.image, **image)
+        executor.shutdown(wait=False)
+
+    def residentBytes(self, assetClass):
+        return self.stats()["classes"].get(assetClass, {}).get("bytes", 0)
+
+    def stats(self):
+        with self.lock:
+            classes = {}
+            for surface, size, assetClass in self.images.values():
+                stats = classes.setdefault(assetClass, {"entries": 0, "bytes": 0})
+                stats["entries"] += 1
+                stats["bytes"] += size
+            fontStats = classes.setdefault("font", {"entries": 0, "bytes": 0})
+            for font, size in self.fonts.values():
+                fontStats["entries"] += 1
+                fontStats["bytes"] += size
+            lookups = self.hits + self.misses
+            return {"classes": classes,
+                    "imageBytes": self.imageBytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hitRate": (self.hits / lookups) if lookups > 0 else 0.0}
+
+
+assets = AssetManager(cfg.get("assetCacheMaxBytes") or 32 * 1024 * 1024,
+                      cfg.get("assetWorkers") or 4)
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+# Headless render benchmark. Runs each tile class and the TileManager
+# offscreen (SDL's dummy video driver) against the recorded responses in
+# fixtures/ (replayed through the data source layer), so no screen,
+# network or API keys are needed, and writes the results as JSON so runs
+# can be compared.
+#
+#   python3 benchmark.py [--config FILE] [--output FILE] [--iterations N] [--rotations N]
+#                        [--latency-scale X]
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+parser = argparse.ArgumentParser(description="Headless shopclock render benchmark")
+parser.add_argument("--config", default="shopclock-config-sample.yaml")
+parser.add_argument("--output", default="bench_output.json")
+parser.add_argument("--iterations", type=int, default=50)
+parser.add_argument("--rotations", type=int, default=4)
+parser.add_argument("--latency-scale", type=float, default=0.0,
+                    help="multiplier for the recorded response latencies (0 = instant)")
+args = parser.parse_args()
+os.environ.setdefault("SHOPCLOCK_CONFIG", args.config)
+
+import configuration  # noqa: E402
+
+cfg = configuration.cfg
+# keep the benchmark away from the real display and the real caches
+scratch = tempfile.mkdtemp(prefix="shopclock-bench-")
+cfg["fullscreen"] = False
+cfg["snapshotFile"] = os.path.join(scratch, "snapshot.json")
+cfg["imageCacheDir"] = os.path.join(scratch, "images")
+fixtureDir = "fixtures"
+cfg["dataSourceMode"] = "replay"
+cfg["dataSourceDir"] = fixtureDir
+cfg["replayTimeScale"] = args.latency_scale
+cfg["replayLatency"] = None
+cfg["replayErrorRate"] = 0.0
+cfg["openWeatherCityID"] = "5128638"
+
+import pygame  # noqa: E402
+from shopclock import TileManager  # noqa: E402
+from tiles import TextTile, CPUTemperatureTile  # noqa: E402
+from weathertiles import WeatherCurrentTile, WeatherForecastTile  # noqa: E402
+from twittertiles import RandomTweetTile  # noqa: E402
+from imagecache import imageCache  # noqa: E402
+from assets import assets  # noqa: E402
+from weatherfetcher import weatherFetcher  # noqa: E402
+from utils import getCPUTemp, scaledSurfaceCache  # noqa: E402
+from textcache import textSurfaceCache  # noqa: E402
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {"count": len(ordered),
+            "mean": statistics.mean(ordered),
+            "median": statistics.median(ordered),
+            "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+            "min": ordered[0],
+            "max": ordered[-1]}
+
+
+def timeCalls(function, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def createTiles():
+    # one tile of each class, refreshed from the replayed fixtures
+    tiles = []
+    tiles.append(TextTile({"type": "Text", "text": "BENCH", "textColor": "#FFFFFF",
+                           "backgroundColor": "#000080"}))
+    try:
+        getCPUTemp()
+        tiles.append(CPUTemperatureTile({"type": "CPUTemperature", "textColor": "#0000FF",
+                                         "backgroundColor": "#FFFFFF"}))
+    except OSError:
+        print("No CPU temperature sensor here, skipping CPUTemperatureTile", file=sys.stderr)
+    current = WeatherCurrentTile({"type": "WeatherCurrent", "textColor": "#000000",
+                                  "backgroundColor": "#80C0FF", "iconSize": 175})
+    tiles.append(current)
+    forecast = WeatherForecastTile({"type": "WeatherForecast", "textColor": "#FFFFFF",
+                                    "backgroundColor": "#000000", "iconSize": 75})
+    tiles.append(forecast)
+    weatherFetcher.refresh("weather")
+    weatherFetcher.refresh("forecast")
+    tweet = RandomTweetTile({"type": "RandomTweet", "title": "News", "textColor": "#000000",
+                             "backgroundColor": "#FFFFFF", "fontSize": 24,
+                             "query": "from:%s", "searches": ["AP"]})
+    tweet.getANewTweet()
+    tiles.append(tweet)
+    for tile in tiles:
+        if tile.serviceError:
+            print("%s failed to load its fixture data" % type(tile).__name__, file=sys.stderr)
+    return tiles
+
+
+def main():
+    tracemalloc.start()
+    results = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "pygame": pygame.version.ver,
+               "platform": platform.platform(),
+               "iterations": args.iterations,
+               "config": args.config}
+
+    manager = TileManager()
+    pygame.init()
+    pygame.display.set_mode((cfg["screenWidth"], cfg["screenHeight"]))
+    tiles = createTiles()
+
+    # per-tile render time
+    results["tileRender"] = {}
+    for tile in tiles:
+        name = type(tile).__name__
+
+        def renderMipmapsUncached(tile=tile):
+            tile.lastRender = None
+            tile.renderMipmaps()
+        results["tileRender"][name] = {"render": timeCalls(tile.render, args.iterations),
+                                       "renderMipmaps": timeCalls(renderMipmapsUncached,
+                                                                  args.iterations),
+                                       "renderMipmapsMemoized": timeCalls(tile.renderMipmaps,
+                                                                          args.iterations)}
+
+    # data refresh (fetch from the replayed fixtures and parse)
+    results["refresh"] = {}
+    refreshIterations = max(int(args.iterations / 5), 1)
+    for endpoint in ("weather", "forecast"):
+        results["refresh"]["OpenWeather:%s" % endpoint] = \
+            timeCalls(lambda: weatherFetcher.refresh(endpoint), refreshIterations)
+    for tile in tiles:
+        if isinstance(tile, RandomTweetTile):
+            results["refresh"][type(tile).__name__] = timeCalls(tile.getANewTweet, refreshIterations)
+
+    # full frames (tiles redrawn) and clock-only frames (what the clock tick costs)
+    manager.setup(tiles)
+
+    def fullFrame():
+        manager.tilesDirty = True
+        manager.renderFull()
+
+    results["renderFull"] = {"tilesRedrawn": timeCalls(fullFrame, args.iterations),
+                             "clockOnly": timeCalls(manager.renderFull, args.iterations)}
+
+    # rotation animation
+    rotations = []
+    for i in range(args.rotations):
+        manager.rotateTiles()
+        animation = manager.lastAnimation
+        rotations.append({"frames": animation.framesDrawn,
+                          "dropped": animation.framesDropped,
+                          "elapsed": animation.elapsed,
+                          "achievedFPS": animation.achievedFPS(),
+                          "targetFPS": animation.fps})
+    results["rotation"] = {"runs": rotations,
+                           "meanAchievedFPS": statistics.mean(r["achievedFPS"] for r in rotations)
+                           if len(rotations) > 0 else 0.0}
+
+    current, peak = tracemalloc.get_traced_memory()
+    results["memory"] = {"pythonPeakBytes": peak,
+                         "pythonCurrentBytes": current,
+                         # ru_maxrss is in kilobytes on Linux
+                         "maxRSSBytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    results["caches"] = {"scaledSurfaces": scaledSurfaceCache.stats(),
+                         "textSurfaces": textSurfaceCache.stats(),
+                         "assets": assets.stats(),
+                         "images": imageCache.stats()}
+
+    manager.stop()
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print("Wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+from datetime import datetime
+import pygame
+from textcache import fontLock
+
+digits = "0123456789"
+
+
+def formatCharacters(*formats):
+    # every character a strftime format can produce, found by formatting
+    # a sample of dates that covers all the month and weekday names and
+    # both halves of the day
+    chars = set(digits)
+    for fmt in formats:
+        for month in range(1, 13):
+            for day in range(1, 8):
+                for hour in (0, 13):
+                    chars.update(datetime(2024, month, day, hour).strftime(fmt))
+    return chars
+
+
+class GlyphAtlas:
+    # each character pre-rendered once in one font and color. in fixed
+    # digit mode every digit gets a cell as wide as the widest digit, so
+    # a changing time doesn't make the rest of the line shift around.
+    def __init__(self, font, color, background, chars, fixedDigits=True):
+        self.font = font
+        self.color = color
+        self.background = background
+        self.fixedDigits = fixedDigits
+        with fontLock:
+            self.height = font.get_height()
+            self.digitWidth = max(font.size(digit)[0] for digit in digits)
+        self.glyphs = {}
+        for char in chars:
+            self.addGlyph(char)
+
+    def addGlyph(self, char):
+        with fontLock:
+            surface = self.font.render(char, True, self.color, self.background)
+        if self.fixedDigits and char in digits:
+            cellWidth = self.digitWidth
+        else:
+            cellWidth = surface.get_width()
+        self.glyphs[char] = (surface, cellWidth)
+        return self.glyphs[char]
+
+    def glyph(self, char):
+        # characters we didn't anticipate get rendered the first time they show up
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            glyph = self.addGlyph(char)
+        return glyph
+
+    def layout(self, text):
+        # returns [(char, x, cellWidth)] and the total width
+        cells = []
+        x = 0
+        for char in text:
+            surface, cellWidth = self.glyph(char)
+            cells.append((char, x, cellWidth))
+            x += cellWidth
+        return cells, x
+
+
+class ClockText:
+    # one line of text composed from an atlas onto a persistent surface.
+    # when the layout hasn't moved, only the cells whose character changed
+    # are redrawn, and only their rects are reported as dirty.
+    def __init__(self, atlas):
+        self.atlas = atlas
+        self.cells = None
+        self.origin = None
+        self.width = 0
+
+    def drawCell(self, surface, char, x, cellWidth, y):
+        glyph, glyphCellWidth = self.atlas.glyph(char)
+        rect = pygame.Rect(x, y, cellWidth, self.atlas.height)
+        surface.fill(self.atlas.background, rect)
+        # center the glyph in its cell (only matters for fixed-width digits)
+        surface.blit(glyph, (x + int((cellWidth - glyph.get_width()) / 2), y))
+        return rect
+
+    def draw(self, surface, text, x, y, alignRight=False):
+        # x is the left edge, or the right edge if alignRight. returns the dirty rects.
+        cells, width = self.atlas.layout(text)
+        if alignRight:
+            x = x - width
+        dirty = []
+        if self.cells is not None and self.origin == (x, y) and \
+                [cell[1:] for cell in cells] == [cell[1:] for cell in self.cells]:
+            for new, old in zip(cells, self.cells):
+                if new[0] != old[0]:
+                    dirty.append(self.drawCell(surface, new[0], x + new[1], new[2], y))
+        else:
+            # layout changed, so clear the old text and draw it all
+            if self.cells is not None:
+                oldRect = pygame.Rect(self.origin[0], self.origin[1], self.width, self.atlas.height)
+                surface.fill(self.atlas.background, oldRect)
+                dirty.append(oldRect)
+            for char, cellX, cellWidth in cells:
+                self.drawCell(surface, char, x + cellX, cellWidth, y)
+            dirty.append(pygame.Rect(x, y, width, self.atlas.height))
+        self.cells = cells
+        self.origin = (x, y)
+        self.width = width
+        return dirty
@@ -0,0 +1,68 @@
+import pygame
+
+
+# A layer is an offscreen surface covering one rectangle of the screen.
+# Callers draw into layer.surface in layer-local coordinates and then
+# invalidate the layer; the compositor copies only invalidated layers
+# to the screen and pushes only those rectangles to the display.
+class Layer:
+    def __init__(self, name, rect):
+        self.name = name
+        self.rect = pygame.Rect(rect)
+        self.surface = pygame.Surface(self.rect.size)
+        self.dirtyRects = []
+
+    def invalidate(self, rect=None):
+        # rect is in layer-local coordinates; None means the whole layer
+        if rect is None:
+            rect = pygame.Rect(0, 0, self.rect.width, self.rect.height)
+        self.dirtyRects.append(pygame.Rect(rect))
+
+    def isDirty(self):
+        return len(self.dirtyRects) > 0
+
+
+class Compositor:
+    def __init__(self, screen):
+        self.screen = screen
+        self.layers = []
+        self.listeners = []
+
+    def addLayer(self, name, rect):
+        layer = Layer(name, rect)
+        self.layers.append(layer)
+        return layer
+
+    def getLayer(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        return None
+
+    def addListener(self, listener):
+        # listener(screen, rects) is called after each present that changed
+        # the screen, e.g. to publish the frame to other displays
+        self.listeners.append(listener)
+
+    def invalidateAll(self):
+        for layer in self.layers:
+            layer.invalidate()
+
+    def present(self):
+        # copy dirty regions of each layer to the screen and push just those
+        # rectangles to the display. returns the list of screen rects updated.
+        updated = []
+        for layer in self.layers:
+            for rect in layer.dirtyRects:
+                rect = rect.clip(layer.surface.get_rect())
+                if rect.width == 0 or rect.height == 0:
+                    continue
+                screenRect = rect.move(layer.rect.topleft)
+                self.screen.blit(layer.surface, screenRect, area=rect)
+                updated.append(screenRect)
+            layer.dirtyRects = []
+        if len(updated) > 0:
+            pygame.display.update(updated)
+            for listener in self.listeners:
+                listener(self.screen, updated)
+        return updated
@@ -1,9 +1,11 @@
 #!/usr/bin/python3
 
+import os
 import yaml
 from PIL import Image
 
-cfg = yaml.safe_load(open("shopclock-config.yaml"))
+# SHOPCLOCK_CONFIG can point at a different config file (e.g. for the benchmark)
+cfg = yaml.safe_load(open(os.environ.get("SHOPCLOCK_CONFIG") or "shopclock-config.yaml"))
 
 resizeFilter = Image.BICUBIC
 resizeFilterFast = Image.NEAREST
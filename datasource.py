@@ -0,0 +1,221 @@
+from threading import Lock
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+import tweepy
+import configuration
+from httpclient import httpClient
+
+cfg = configuration.cfg
+
+# timestamp fields in recorded payloads that get moved up to "now" on replay
+timestampFields = ("dt", "sunrise", "sunset")
+
+
+class DataSourceError(Exception):
+    pass
+
+
+def sanitizeKey(key):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", key)
+
+
+class LiveDataSource:
+    # every request goes to the real service. request() takes the service
+    # name, a key identifying the request, and a function that does the
+    # live fetch and returns (payload, changed). payloads are JSON-able
+    # data, or bytes for binary services like images.
+    def request(self, service, key, fetch):
+        return fetch()
+
+
+class RecordingDataSource(LiveDataSource):
+    # goes to the real service and saves each response (and how long it
+    # took) under directory/service/key.json for later replay. a bytes
+    # payload goes in a file of its own next to it, named by the key.
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = Lock()
+
+    def request(self, service, key, fetch):
+        start = time.monotonic()
+        payload, changed = fetch()
+        latency = time.monotonic() - start
+        path = os.path.join(self.directory, service, sanitizeKey(key) + ".json")
+        recording = {"recordedAt": time.time(), "latency": latency}
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if isinstance(payload, bytes):
+                    recording["file"] = sanitizeKey(key)
+                    with open(os.path.join(self.directory, service, recording["file"]), "wb") as file:
+                        file.write(payload)
+                else:
+                    recording["response"] = payload
+                with open(path, "w") as file:
+                    json.dump(recording, file, indent=2)
+            except OSError:
+                logging.warning("Couldn't record response to %s", path, exc_info=True)
+        return payload, changed
+
+
+class ReplayDataSource:
+    # serves responses saved by RecordingDataSource without touching the
+    # network. latency is the recorded latency unless a fixed latency is
+    # given, and is multiplied by timeScale (0 for instant replies).
+    # errorRate injects failures. timestamps in the payload are moved
+    # forward so recorded data looks as fresh as it was when recorded.
+    def __init__(self, directory, latency=None, timeScale=1.0, errorRate=0.0):
+        self.directory = directory
+        self.latency = latency
+        self.timeScale = timeScale
+        self.errorRate = errorRate
+
+    def request(self, service, key, fetch):
+        path = os.path.join(self.directory, service, sanitizeKey(key) + ".json")
+        try:
+            with open(path) as file:
+                recording = json.load(file)
+        except OSError:
+            raise DataSourceError("No recording for %s %s (%s)" % (service, key, path))
+        latency = self.latency if self.latency is not None else recording.get("latency", 0.0)
+        if latency * self.timeScale > 0:
+            time.sleep(latency * self.timeScale)
+        if self.errorRate > 0 and random.random() < self.errorRate:
+            raise DataSourceError("Injected error for %s %s" % (service, key))
+        if "file" in recording:
+            try:
+                with open(os.path.join(self.directory, service, recording["file"]), "rb") as file:
+                    return file.read(), True
+            except OSError:
+                raise DataSourceError("Missing recorded file for %s %s" % (service, key))
+        payload = recording["response"]
+        recordedAt = recording.get("recordedAt")
+        if recordedAt is not None:
+            rebaseTimestamps(payload, int(time.time() - recordedAt))
+        return payload, True
+
+
+def rebaseTimestamps(payload, offset):
+    if isinstance(payload, dict):
+        for key, value in payload.items():
+            if key in timestampFields and isinstance(value, int):
+                payload[key] = value + offset
+            else:
+                rebaseTimestamps(value, offset)
+    elif isinstance(payload, list):
+        for item in payload:
+            rebaseTimestamps(item, offset)
+
+
+class OpenWeatherClient:
+    # source is the data source to go through; by default the one set up
+    # from the config when it's first needed
+    def __init__(self, baseURL, apiKey, source=None):
+        self.source = source
+        self.baseURL = baseURL
+        self.apiKey = apiKey
+
+    def query(self, endpoint, params):
+        # returns (data, changed); the API key is left out of the recording key
+        key = "-".join([endpoint] + [str(params[name]) for name in sorted(params)])
+        source = self.source or getDataSource()
+        return source.request("openweather", key, lambda: self.fetch(endpoint, params))
+
+    def fetch(self, endpoint, params):
+        fullParams = dict(params)
+        fullParams["APPID"] = self.apiKey
+        fullParams["units"] = "imperial"
+        return httpClient.getJSON(self.baseURL + endpoint, fullParams)
+
+
+class TwitterClient:
+    # search results and statuses come back as the raw JSON dicts, so they
+    # can be recorded; parse() turns one back into a tweepy Status
+    def __init__(self, apiKey, apiSecretKey, host=None, source=None):
+        self.source = source
+        auth = tweepy.OAuthHandler(apiKey, apiSecretKey)
+        if host is not None:
+            self.api = tweepy.API(auth, host=host)
+        else:
+            self.api = tweepy.API(auth)
+
+    def search(self, query, language, resultType, count):
+        def fetch():
+            results = tweepy.Cursor(self.api.search,
+                                    q=query,
+                                    lang=language,
+                                    result_type=resultType,
+                                    include_entities=True,
+                                    count=count).items(count)
+            return [tweet._json for tweet in results], True
+        source = self.source or getDataSource()
+        return source.request("twitter", "search-%s" % query, fetch)[0]
+
+    def lookupStatuses(self, ids):
+        # full statuses for up to 100 tweet IDs in one request
+        ids = sorted(str(id) for id in ids)
+        key = "lookup-%s" % "_".join(ids)
+        if len(key) > 100:
+            key = "lookup-%s" % hashlib.sha1(key.encode("utf-8")).hexdigest()
+        source = self.source or getDataSource()
+        return source.request("twitter", key,
+                              lambda: ([tweet._json for tweet in self.api.statuses_lookup(ids)],
+                                       True))[0]
+
+    def parse(self, statusJSON):
+        return tweepy.models.Status.parse(self.api, statusJSON)
+
+
+class ImageClient:
+    # remote images (e.g. profile photos) as raw bytes
+    def __init__(self, source=None):
+        self.source = source
+
+    def get(self, url):
+        # keyed by a hash of the URL, plus the file name to keep recordings readable
+        key = "%s-%s" % (hashlib.sha1(url.encode("utf-8")).hexdigest()[:12], url.rsplit("/", 1)[-1])
+        source = self.source or getDataSource()
+        return source.request("images", key, lambda: (httpClient.getBytes(url), True))[0]
+
+
+def createDataSource():
+    mode = (cfg.get("dataSourceMode") or "live").lower()
+    directory = cfg.get("dataSourceDir") or "recordings"
+    if mode == "record":
+        logging.info("Recording data source responses to %s", directory)
+        return RecordingDataSource(directory)
+    if mode == "replay":
+        logging.info("Replaying data source responses from %s", directory)
+        timeScale = cfg.get("replayTimeScale")
+        return ReplayDataSource(directory,
+                                cfg.get("replayLatency"),
+                                1.0 if timeScale is None else timeScale,
+                                cfg.get("replayErrorRate") or 0.0)
+    return LiveDataSource()
+
+
+dataSource = None
+dataSourceLock = Lock()
+
+
+def getDataSource():
+    # made on first use rather than on import, so it's set up (and says
+    # which mode it's in) after the app has configured logging
+    global dataSource
+    with dataSourceLock:
+        if dataSource is None:
+            dataSource = createDataSource()
+        return dataSource
+
+
+openWeather = OpenWeatherClient(cfg.get("openWeatherBaseURL") or "https://api.openweathermap.org/data/2.5/",
+                                cfg["openWeatherAPIKey"])
+twitter = TwitterClient(cfg["twitterAPIKey"],
+                        cfg["twitterAPISecretKey"],
+                        cfg.get("twitterAPIHost"))
+images = ImageClient()
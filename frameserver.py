@@ -0,0 +1,125 @@
+from threading import Condition, Lock, Thread
+import logging
+import socket
+import struct
+import zlib
+import pygame
+from metrics import metrics
+
+# Wire format (all integers big-endian):
+#   hello, once per connection:  b"SCFS" width:u16 height:u16
+#   update, after every change:  b"SCUP" count:u16, then count regions of
+#                                x:u16 y:u16 w:u16 h:u16 length:u32 + length
+#                                bytes of zlib-compressed RGB pixels
+helloHeader = struct.Struct(">4sHH")
+updateHeader = struct.Struct(">4sH")
+regionHeader = struct.Struct(">HHHHI")
+
+
+class FrameClient:
+    def __init__(self, connection, address, fullFrame):
+        self.connection = connection
+        self.address = address
+        # regions changed since the last update we sent this client. a slow
+        # client just accumulates (merged) regions instead of queued frames.
+        self.dirtyRects = [fullFrame]
+        self.closed = False
+
+
+class FrameServer:
+    # publishes the composed screen to other local displays. the render
+    # thread only copies the changed regions into the server's own frame
+    # and marks them dirty for each client; each client has a thread that
+    # reads those regions back out, compresses and sends them. a client
+    # that can't keep up gets fewer, larger updates, and never holds up
+    # the render loop.
+    def __init__(self, screen, port, host="127.0.0.1", maxClients=4, maxRects=8, compression=1):
+        self.frame = screen.copy()
+        self.port = port
+        self.host = host
+        self.maxClients = maxClients
+        self.maxRects = maxRects
+        self.compression = compression
+        self.lock = Lock()  # guards self.frame
+        self.condition = Condition()  # guards the clients and their dirty rects
+        self.clients = []
+        self.listener = None
+
+    def start(self):
+        self.listener = socket.create_server((self.host, self.port))
+        Thread(target=self.accept, name="frameserver", daemon=True).start()
+        metrics.setGauge("shopclock_frame_server_clients", lambda: len(self.clients))
+        logging.info("Serving frames on %s:%s", self.host, self.port)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.close()
+        with self.condition:
+            for client in self.clients:
+                client.closed = True
+            self.condition.notify_all()
+
+    def accept(self):
+        while True:
+            try:
+                connection, address = self.listener.accept()
+            except OSError:
+                return  # listener closed
+            with self.condition:
+                if len(self.clients) >= self.maxClients:
+                    logging.warning("Too many frame server clients, refusing %s", address)
+                    connection.close()
+                    continue
+                client = FrameClient(connection, address, self.frame.get_rect())
+                self.clients.append(client)
+            logging.info("Frame server client %s connected", address)
+            Thread(target=self.serve, args=(client,), name="frameserver-client", daemon=True).start()
+
+    def publish(self, screen, rects):
+        # called on the render thread after the compositor updates the screen
+        if len(rects) == 0:
+            return
+        rects = [rect.clip(self.frame.get_rect()) for rect in rects]
+        rects = [rect for rect in rects if rect.width > 0 and rect.height > 0]
+        with self.lock:
+            for rect in rects:
+                self.frame.blit(screen, rect, area=rect)
+        with self.condition:
+            for client in self.clients:
+                client.dirtyRects.extend(rects)
+                if len(client.dirtyRects) > self.maxRects:
+                    client.dirtyRects = [client.dirtyRects[0].unionall(client.dirtyRects[1:])]
+            self.condition.notify_all()
+
+    def serve(self, client):
+        try:
+            width, height = self.frame.get_size()
+            client.connection.sendall(helloHeader.pack(b"SCFS", width, height))
+            while True:
+                with self.condition:
+                    while len(client.dirtyRects) == 0 and not client.closed:
+                        self.condition.wait()
+                    if client.closed:
+                        return
+                    rects = client.dirtyRects
+                    client.dirtyRects = []
+                with self.lock:
+                    regions = [(rect, pygame.image.tostring(self.frame.subsurface(rect), "RGB"))
+                               for rect in rects]
+                message = [updateHeader.pack(b"SCUP", len(regions))]
+                for rect, pixels in regions:
+                    compressed = zlib.compress(pixels, self.compression)
+                    message.append(regionHeader.pack(rect.x, rect.y, rect.width, rect.height,
+                                                     len(compressed)))
+                    message.append(compressed)
+                message = b"".join(message)
+                client.connection.sendall(message)
+                metrics.increment("shopclock_frame_server_bytes_total", len(message))
+        except OSError:
+            pass
+        finally:
+            logging.info("Frame server client %s disconnected", client.address)
+            client.connection.close()
+            with self.condition:
+                if client in self.clients:
+                    self.clients.remove(client)
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+# Shows the frames published by a shopclock running with frameServerPort
+# set, for a second display on the same machine (or over an SSH tunnel).
+#
+#   python3 frameviewer.py [--host HOST] [--port PORT] [--fullscreen]
+
+import argparse
+import queue
+import socket
+import sys
+import zlib
+from threading import Thread
+import pygame
+from frameserver import helloHeader, updateHeader, regionHeader
+
+
+def readExactly(connection, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = connection.recv(length - len(data))
+        if len(chunk) == 0:
+            raise ConnectionError("Frame server closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def readUpdates(connection, updates):
+    # decompress on this thread so the display loop only blits
+    try:
+        while True:
+            magic, count = updateHeader.unpack(readExactly(connection, updateHeader.size))
+            if magic != b"SCUP":
+                raise ConnectionError("Unexpected message from frame server")
+            regions = []
+            for i in range(count):
+                x, y, width, height, length = regionHeader.unpack(readExactly(connection,
+                                                                              regionHeader.size))
+                pixels = zlib.decompress(readExactly(connection, length))
+                regions.append((pygame.Rect(x, y, width, height), pixels))
+            updates.put(regions)
+    except (OSError, zlib.error) as e:
+        updates.put(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="View frames from a shopclock frame server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fullscreen", action="store_true")
+    args = parser.parse_args()
+
+    connection = socket.create_connection((args.host, args.port))
+    magic, width, height = helloHeader.unpack(readExactly(connection, helloHeader.size))
+    if magic != b"SCFS":
+        sys.exit("Not a shopclock frame server")
+
+    pygame.init()
+    if args.fullscreen:
+        screen = pygame.display.set_mode((width, height), pygame.FULLSCREEN)
+        pygame.mouse.set_visible(False)
+    else:
+        screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("shopclock")
+
+    updates = queue.Queue()
+    Thread(target=readUpdates, args=(connection, updates), daemon=True).start()
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                connection.close()
+                return
+        try:
+            regions = updates.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if isinstance(regions, Exception):
+            sys.exit(str(regions))
+        for rect, pixels in regions:
+            screen.blit(pygame.image.frombuffer(pixels, rect.size, "RGB"), rect)
+        pygame.display.update([rect for rect, pixels in regions])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from threading import Lock
+import logging
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import configuration
+
+cfg = configuration.cfg
+
+# statuses worth retrying; anything else is returned to the caller as is
+retryStatuses = (429, 500, 502, 503, 504)
+
+
+class HTTPClient:
+    # one process-wide HTTP layer: a pooled keep-alive session, a timeout
+    # on every request, retries with jittered exponential backoff, and
+    # ETag / Last-Modified revalidation for JSON payloads.
+    def __init__(self, timeout=10, retries=3, backoff=1.0, backoffMax=30.0, poolSize=4):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoffMax = backoffMax
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.validators = {}  # (url, params) -> (etag, lastModified, parsed data)
+        self.lock = Lock()
+
+    def backoffDelay(self, attempt):
+        # "full jitter": a random delay up to the exponential backoff cap
+        return random.uniform(0, min(self.backoffMax, self.backoff * (2 ** attempt)))
+
+    def get(self, url, params=None, headers=None):
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.get(url, params=params, headers=headers,
+                                        timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+                logging.info("Request to %s failed, retrying", url, exc_info=True)
+            else:
+                if resp.status_code not in retryStatuses or attempt >= self.retries:
+                    return resp
+                logging.info("Request to %s returned %s, retrying", url, resp.status_code)
+            time.sleep(self.backoffDelay(attempt))
+            attempt += 1
+
+    def getBytes(self, url, params=None):
+        resp = self.get(url, params)
+        resp.raise_for_status()
+        return resp.content
+
+    def getJSON(self, url, params=None):
+        # returns (data, changed). if the server says the payload hasn't
+        # changed since we last fetched it, the previously parsed data is
+        # returned with changed=False so the caller can skip reprocessing.
+        key = (url, tuple(sorted((params or {}).items())))
+        with self.lock:
+            cached = self.validators.get(key)
+        headers = {}
+        if cached is not None:
+            etag, lastModified, data = cached
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if lastModified is not None:
+                headers["If-Modified-Since"] = lastModified
+        resp = self.get(url, params, headers)
+        if resp.status_code == 304 and cached is not None:
+            return cached[2], False
+        resp.raise_for_status()
+        data = resp.json()
+        etag = resp.headers.get("ETag")
+        lastModified = resp.headers.get("Last-Modified")
+        if etag is not None or lastModified is not None:
+            with self.lock:
+                self.validators[key] = (etag, lastModified, data)
+        return data, True
+
+
+httpClient = HTTPClient(cfg.get("httpTimeout") or 10,
+                        cfg.get("httpRetries") if cfg.get("httpRetries") is not None else 3,
+                        cfg.get("httpBackoff") or 1.0)
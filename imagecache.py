@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from io import BytesIO
+from threading import Lock
+import hashlib
+import logging
+import os
+import time
+import pygame
+import configuration
+from datasource import images
+
+cfg = configuration.cfg
+
+
+class ImageCache:
+    # two-level cache for remote images: an in-memory LRU of decoded
+    # surfaces, backed by an on-disk store of the raw bytes with a TTL and
+    # a total size cap. prefetch() may hit the network; get() never does.
+    def __init__(self, directory, maxEntries=32, ttl=86400, maxBytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.surfaces = OrderedDict()
+        self.lock = Lock()
+        self.diskLock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def pathFor(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def get(self, url):
+        # memory only, so this is safe to call from a render
+        with self.lock:
+            surface = self.surfaces.get(url)
+            if surface is None:
+                self.misses += 1
+                return None
+            self.surfaces.move_to_end(url)
+            self.hits += 1
+            return surface
+
+    def prefetch(self, url):
+        # make sure the image for url is decoded and in memory, loading it
+        # from disk if we have a fresh copy there, or from the network if not
+        if url is None:
+            return None
+        with self.lock:
+            if url in self.surfaces:
+                self.surfaces.move_to_end(url)
+                return self.surfaces[url]
+        try:
+            data = self.readDisk(url)
+            if data is None:
+                data = images.get(url)
+                self.writeDisk(url, data)
+            surface = pygame.image.load(BytesIO(data))
+        except Exception:
+            logging.info("Exception fetching image from %s", url, exc_info=True)
+            return None
+        with self.lock:
+            self.surfaces[url] = surface
+            self.surfaces.move_to_end(url)
+            while len(self.surfaces) > self.maxEntries:
+                self.surfaces.popitem(last=False)
+        return surface
+
+    def readDisk(self, url):
+        path = self.pathFor(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def writeDisk(self, url, data):
+        path = self.pathFor(url)
+        with self.diskLock:
+            try:
+                # made on first use, so just importing this doesn't touch the disk
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path + ".tmp", "wb") as file:
+                    file.write(data)
+                os.replace(path + ".tmp", path)
+                self.trimDisk()
+            except OSError:
+                logging.warning("Couldn't write image cache file %s", path, exc_info=True)
+
+    def trimDisk(self):
+        # drop expired files, then the oldest ones until we're under the size cap
+        now = time.time()
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                os.remove(path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.surfaces), "hits": self.hits, "misses": self.misses}
+
+
+imageCache = ImageCache(cfg.get("imageCacheDir") or "cache/images",
+                        cfg.get("imageCacheSize") or 32,
+                        cfg.get("imageCacheTTL") or 86400,
+                        cfg.get("imageCacheMaxBytes") or 16 * 1024 * 1024)
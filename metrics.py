@@ -0,0 +1,152 @@
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import logging
+import time
+
+
+class Histogram:
+    # rolling window of recent samples (for percentiles), plus running
+    # totals (for the Prometheus _sum and _count)
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        if len(self.samples) == 0:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def formatLabels(key, extra=None):
+    items = list(key)
+    if extra is not None:
+        items.append(extra)
+    if len(items) == 0:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace('"', '\\"'))
+                          for name, value in items) + "}"
+
+
+class Metrics:
+    # process-wide registry of rolling latency histograms, counters and
+    # gauges. gauges can also be callbacks that are evaluated when the
+    # metrics are read, for things like data staleness and cache sizes.
+    def __init__(self, window=500):
+        self.window = window
+        self.histograms = {}  # name -> {labelKey: Histogram}
+        self.counters = {}  # name -> {labelKey: value}
+        self.gauges = {}  # name -> {labelKey: value or callable}
+        self.lock = Lock()
+
+    def observe(self, name, value, **labels):
+        key = labelKey(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = Histogram(self.window)
+                series[key] = histogram
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def acquire(self, semaphore, **labels):
+        # acquire a semaphore, recording how long we waited for it
+        start = time.perf_counter()
+        semaphore.acquire()
+        self.observe("shopclock_semaphore_wait_seconds", time.perf_counter() - start, **labels)
+
+    def increment(self, name, amount=1, **labels):
+        key = labelKey(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def setGauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[labelKey(labels)] = value
+
+    def histogram(self, name, **labels):
+        with self.lock:
+            return self.histograms.get(name, {}).get(labelKey(labels))
+
+    def readGauge(self, value):
+        if callable(value):
+            try:
+                return value()
+            except Exception:
+                return float("nan")
+        return value
+
+    def prometheusText(self):
+        lines = []
+        with self.lock:
+            histograms = {name: dict(series) for name, series in self.histograms.items()}
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            gauges = {name: dict(series) for name, series in self.gauges.items()}
+        for name in sorted(histograms):
+            lines.append("# TYPE %s summary" % name)
+            for key, histogram in histograms[name].items():
+                for quantile in (0.5, 0.9, 0.99):
+                    lines.append("%s%s %g" % (name, formatLabels(key, ("quantile", quantile)),
+                                              histogram.percentile(quantile)))
+                lines.append("%s_sum%s %g" % (name, formatLabels(key), histogram.sum))
+                lines.append("%s_count%s %d" % (name, formatLabels(key), histogram.count))
+        for name in sorted(counters):
+            lines.append("# TYPE %s counter" % name)
+            for key, value in counters[name].items():
+                lines.append("%s%s %g" % (name, formatLabels(key), value))
+        for name in sorted(gauges):
+            lines.append("# TYPE %s gauge" % name)
+            for key, value in gauges[name].items():
+                value = self.readGauge(value)
+                if value is not None:
+                    lines.append("%s%s %g" % (name, formatLabels(key), value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.prometheusText().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics request: " + format, *args)
+
+
+def startMetricsServer(port, host="127.0.0.1"):
+    # serve /metrics in Prometheus text format on a background thread
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,125 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import logging
+import time
+import pygame
+import configuration
+from utils import Mipmap, tupleColor
+
+cfg = configuration.cfg
+
+
+class Prerenderer:
+    # renders upcoming tiles ahead of time on a thread pool so a rotation
+    # only has to swap in a finished surface. if a render is late, the last
+    # finished surface for that tile is used instead.
+    def __init__(self, tileSet, workers=2, historySize=50):
+        self.tileSet = tileSet
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="prerender")
+        self.lock = Lock()
+        self.pending = {}  # tile index -> future
+        self.lastGood = {}  # tile index -> last finished render
+        self.latencies = {}  # tile index -> deque of recent render times (seconds)
+        self.historySize = historySize
+        self.blank = None
+
+    def schedule(self, index):
+        index = index % len(self.tileSet)
+        with self.lock:
+            if index in self.pending:
+                return
+            self.pending[index] = self.executor.submit(self.renderTile, index)
+
+    def renderTile(self, index):
+        tile = self.tileSet[index]
+        start = time.monotonic()
+        try:
+            image = tile.renderMipmaps()
+        except Exception:
+            logging.warning("Exception while prerendering tile %s", index, exc_info=True)
+            raise
+        elapsed = time.monotonic() - start
+        with self.lock:
+            self.lastGood[index] = image
+            self.latencies.setdefault(index, deque(maxlen=self.historySize)).append(elapsed)
+        logging.debug("Prerendered tile %s (%s) in %.3fs", index, type(tile).__name__, elapsed)
+        return image
+
+    def rerender(self, index, callback):
+        # render a tile right away (e.g. because its data just changed) and
+        # hand the result to callback(index, image) when it's done
+        index = index % len(self.tileSet)
+        # anything already in flight for this tile is out of date now
+        with self.lock:
+            self.pending.pop(index, None)
+        self.executor.submit(self.renderTile, index).add_done_callback(self.deliver(index, callback))
+
+    def deliver(self, index, callback):
+        # a done-callback for a render future that hands a successful
+        # render to callback(index, image)
+        def done(future):
+            if future.exception() is None:
+                callback(index, future.result())
+        return done
+
+    def take(self, index, callback=None):
+        # get the freshest finished render for a tile without waiting for one
+        # that's still in progress. this runs on the display thread, so it
+        # never renders or waits for a render: if there's nothing finished
+        # to show, it returns a blank tile, and the render (the one in
+        # flight, or a new one) is handed to callback(index, image) when
+        # it's done.
+        index = index % len(self.tileSet)
+        with self.lock:
+            future = self.pending.get(index)
+            fallback = self.lastGood.get(index)
+        if future is not None and future.done():
+            with self.lock:
+                self.pending.pop(index, None)
+            try:
+                return future.result()
+            except Exception:
+                pass
+        elif future is not None:
+            if fallback is not None:
+                logging.info("Render of tile %s is late, using previous render", index)
+                return fallback
+            logging.info("Render of tile %s is late and there's no previous render", index)
+            if callback is not None:
+                future.add_done_callback(self.deliver(index, callback))
+            return self.blankTile()
+        if fallback is None:
+            # nothing rendered yet and nothing in flight (or it failed)
+            if callback is not None:
+                self.rerender(index, callback)
+            else:
+                self.schedule(index)
+            return self.blankTile()
+        return fallback
+
+    def blankTile(self):
+        if self.blank is None:
+            image = pygame.Surface((cfg["tileSizeLarge"], cfg["tileSizeLarge"]))
+            image.fill(tupleColor(cfg["backgroundColor"]))
+            self.blank = Mipmap(image)
+        return self.blank
+
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for index, samples in self.latencies.items():
+                ordered = sorted(samples)
+                stats[index] = {"tile": type(self.tileSet[index]).__name__,
+                                "count": len(ordered),
+                                "last": samples[-1],
+                                "median": ordered[len(ordered) // 2],
+                                "max": ordered[-1]}
+            return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            self.pending.clear()
+            self.lastGood.clear()
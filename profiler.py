@@ -0,0 +1,94 @@
+from collections import Counter
+from threading import Lock, Thread
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import configuration
+
+cfg = configuration.cfg
+
+
+class SamplingProfiler:
+    # statistical profiler for the running process. when triggered it
+    # samples the stack of every thread (main loop, scheduler and
+    # prerender workers, data fetchers) for a while, then writes the
+    # samples in "folded" format, one stack per line with a count, which
+    # flamegraph.pl and speedscope read directly. (cProfile only sees the
+    # thread that enabled it, so sampling is the way to see all of them.)
+    # frames are "module:function", so each function is one tower in the
+    # flame graph; lineNumbers adds the line being run, at the cost of
+    # splitting a function into one tower per line.
+    def __init__(self, directory, duration=30, interval=0.01, lineNumbers=False):
+        self.directory = directory
+        self.duration = duration
+        self.interval = interval
+        self.lineNumbers = lineNumbers
+        self.lock = Lock()
+        self.running = False
+
+    def trigger(self, duration=None):
+        with self.lock:
+            if self.running:
+                logging.info("Profiler is already running")
+                return False
+            self.running = True
+        Thread(target=self.run, args=(duration or self.duration,),
+               name="profiler", daemon=True).start()
+        return True
+
+    def run(self, duration):
+        try:
+            logging.info("Profiling all threads for %ss", duration)
+            stacks = Counter()
+            samples = 0
+            me = threading.get_ident()
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                threadNames = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                        if self.lineNumbers:
+                            stack.append("%s:%s:%d" % (module, code.co_name, frame.f_lineno))
+                        else:
+                            stack.append("%s:%s" % (module, code.co_name))
+                        frame = frame.f_back
+                    stack.append(threadNames.get(ident, str(ident)))
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(self.interval)
+            path = self.write(stacks)
+            logging.info("Profile of %d samples written to %s", samples, path)
+        except Exception:
+            logging.warning("Exception while profiling", exc_info=True)
+        finally:
+            with self.lock:
+                self.running = False
+
+    def write(self, stacks):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory,
+                            time.strftime("shopclock-%Y%m%d-%H%M%S.folded"))
+        with open(path, "w") as file:
+            for stack, count in stacks.most_common():
+                file.write("%s %d\n" % (stack, count))
+        return path
+
+
+profiler = SamplingProfiler(cfg.get("profileDir") or "profiles",
+                            cfg.get("profileDuration") or 30,
+                            cfg.get("profileInterval") or 0.01,
+                            cfg.get("profileLineNumbers") or False)
+
+
+def installProfilerTrigger():
+    # kill -USR1 <pid> starts a profile. signal handlers can only be
+    # installed from the main thread.
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.trigger())
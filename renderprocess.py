@@ -0,0 +1,265 @@
+from multiprocessing import shared_memory
+from threading import Thread
+import logging
+import gc
+import multiprocessing
+import os
+import queue
+import weakref
+import pygame
+import configuration
+from tiles import PlaceholderTile
+from utils import Mipmap, mipmapSizes
+
+cfg = configuration.cfg
+
+# rendered tiles are handed over as 32-bit pixels, in this byte order
+pixelFormat = "RGBX"
+bytesPerPixel = 4
+
+
+def tileGroup(tileConfig):
+    # tiles that share a data fetcher (e.g. all the weather tiles) go in the
+    # same process, so they still share one request
+    if tileConfig["type"].startswith("Weather"):
+        return "Weather"
+    return tileConfig["type"]
+
+
+def slotLevels():
+    # (width, height) of each mipmap level stored in a slot
+    size = cfg["tileSizeLarge"]
+    return mipmapSizes(size, size)
+
+
+def slotBytes():
+    return sum(width * height * bytesPerPixel for width, height in slotLevels())
+
+
+def levelSurfaces(buffer, slot):
+    # surfaces that use a slot's pixels in place, one per mipmap level
+    surfaces = []
+    offset = slot * slotBytes()
+    for width, height in slotLevels():
+        length = width * height * bytesPerPixel
+        surfaces.append(pygame.image.frombuffer(buffer[offset:offset + length],
+                                                (width, height), pixelFormat))
+        offset += length
+    return surfaces
+
+
+class RemoteTile(PlaceholderTile):
+    # stands in, in the display process, for a tile that lives in a render
+    # process. it shows "Loading..." until the first frame arrives, and
+    # after that hands out the latest frame, which is drawn straight from
+    # shared memory.
+    def __init__(self, tile):
+        super().__init__(tile)
+        self.frame = None
+        self.frameVersion = 0
+
+    def receiveFrame(self, mipmap):
+        self.frame = mipmap
+        self.frameVersion += 1
+        if self.onDataUpdated is not None:
+            self.onDataUpdated(self)
+
+    def receiveStatus(self, status):
+        self.serviceError, self.stale, self.dataTime = status
+
+    def renderKey(self):
+        return (self.frameVersion,)
+
+    def renderMipmaps(self):
+        frame = self.frame
+        if frame is not None:
+            return frame
+        return super().renderMipmaps()
+
+
+class RenderProcesses:
+    # runs the real tiles, including their data refreshes and renders, in
+    # worker processes, so JSON parsing, API calls and rasterization don't
+    # compete with the animation for the GIL. each tile has a block of
+    # shared memory with a few slots; a worker renders into a free slot
+    # (every mipmap level, so the display process doesn't even scale) and
+    # says which one, and the display process wraps the slot's pixels as
+    # surfaces without copying. a slot goes back to the worker when the
+    # display process no longer holds any frame from it.
+    def __init__(self, tileConfigs, processes=2, slotsPerTile=3):
+        self.tileConfigs = tileConfigs
+        self.processes = max(min(processes, len(tileConfigs)), 1)
+        self.slotsPerTile = slotsPerTile
+        self.proxies = [RemoteTile(tile) for tile in tileConfigs]
+        self.memory = []
+        self.workers = []
+        self.commands = []  # one queue per worker
+        self.results = None
+        self.owner = {}  # tile index -> worker number
+        self.receiver = None
+        self.stopped = False
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        for i in range(len(self.tileConfigs)):
+            self.memory.append(shared_memory.SharedMemory(create=True,
+                                                          size=slotBytes() * self.slotsPerTile))
+        # spread the groups of tiles over the workers
+        groups = {}
+        for i in range(len(self.tileConfigs)):
+            groups.setdefault(tileGroup(self.tileConfigs[i]), []).append(i)
+        assignments = [[] for i in range(self.processes)]
+        for number, indexes in enumerate(groups.values()):
+            for index in indexes:
+                self.owner[index] = number % self.processes
+                assignments[number % self.processes].append(
+                    (index, self.tileConfigs[index], self.memory[index].name))
+        for number in range(self.processes):
+            commands = context.Queue()
+            worker = context.Process(target=runWorker,
+                                     args=(assignments[number], self.slotsPerTile,
+                                           commands, self.results),
+                                     name="render-%d" % number,
+                                     daemon=True)
+            worker.start()
+            self.commands.append(commands)
+            self.workers.append(worker)
+        self.receiver = Thread(target=self.receive, name="render-results", daemon=True)
+        self.receiver.start()
+        logging.info("Started %d render processes for %d tiles", self.processes, len(self.tileConfigs))
+
+    def receive(self):
+        while not self.stopped:
+            try:
+                index, slot, status = self.results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            proxy = self.proxies[index]
+            proxy.receiveStatus(status)
+            if slot is not None:
+                self.receiveFrame(index, slot)
+
+    def receiveFrame(self, index, slot):
+        # (in its own method so no frame outlives it in this thread's locals)
+        levels = levelSurfaces(self.memory[index].buf, slot)
+        mipmap = Mipmap(levels[0], levels=levels)
+        # give the slot back once nothing in this process uses the frame
+        weakref.finalize(mipmap, self.release, index, slot)
+        self.proxies[index].receiveFrame(mipmap)
+
+    def release(self, index, slot):
+        if self.stopped:
+            return
+        try:
+            self.commands[self.owner[index]].put(("release", index, slot))
+        except (ValueError, OSError):
+            pass  # queue already closed; we're shutting down
+
+    def stop(self):
+        # the caller must have dropped its own frames (the images on screen,
+        # prerendered and scaled copies) first; shared memory can't be
+        # closed while any surface still points into it
+        self.stopped = True
+        for commands in self.commands:
+            commands.put(("stop",))
+        for worker in self.workers:
+            worker.join(timeout=2.0)
+            if worker.is_alive():
+                worker.terminate()
+        if self.receiver is not None:
+            self.receiver.join(timeout=2.0)
+        for proxy in self.proxies:
+            proxy.frame = None
+        gc.collect()
+        for memory in self.memory:
+            try:
+                memory.close()
+            except BufferError:
+                logging.warning("Frames from render processes are still in use at shutdown")
+            memory.unlink()
+
+
+def runWorker(assignments, slotsPerTile, commands, results):
+    # entry point of a render process: build our tiles, let them refresh
+    # their data on this process's scheduler, and render each one into
+    # shared memory whenever anything it draws changes
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.init()
+    pygame.display.set_mode((1, 1))  # convert() needs a display format
+    from tiletypes import tileTypes
+    from scheduler import scheduler
+    from assets import assets
+
+    tiles = {}
+    memory = {}
+    free = {}  # tile index -> slots the display process isn't using
+    published = {}  # tile index -> renderKey of the last frame sent
+    images = []
+    fonts = []
+    for index, tileConfig, memoryName in assignments:
+        tileImages, tileFonts = tileTypes[tileConfig["type"]].declareAssets(tileConfig)
+        images.extend(tileImages)
+        fonts.extend(tileFonts)
+    assets.preload(images, fonts)
+    for index, tileConfig, memoryName in assignments:
+        memory[index] = shared_memory.SharedMemory(name=memoryName)
+        free[index] = set(range(slotsPerTile))
+        try:
+            tile = tileTypes[tileConfig["type"]](tileConfig)
+        except Exception:
+            logging.error("Exception while creating %s tile", tileConfig["type"], exc_info=True)
+            continue
+        # data refreshes happen on scheduler threads; wake the loop below
+        tile.onDataUpdated = lambda tile, index=index: commands.put(("dirty", index))
+        tiles[index] = tile
+    scheduler.start()
+
+    checkInterval = cfg.get("renderCheckInterval") or 5.0
+    while True:
+        try:
+            command = commands.get(timeout=checkInterval)
+        except queue.Empty:
+            command = None
+        if command is not None:
+            if command[0] == "stop":
+                break
+            if command[0] == "release":
+                free[command[1]].add(command[2])
+        # look for tiles whose image would change (including with the time
+        # of day) and send them over if there's a free slot
+        for index, tile in tiles.items():
+            status = (tile.serviceError, tile.stale, tile.dataTime)
+            try:
+                # some keys read a sensor (e.g. the CPU temperature)
+                key = tile.renderKey()
+            except Exception:
+                logging.warning("Exception while checking tile %s", index, exc_info=True)
+                continue
+            if published.get(index) == key:
+                if command is not None and command[0] == "dirty" and command[1] == index:
+                    results.put((index, None, status))  # refreshed, but nothing to redraw
+                continue
+            if len(free[index]) == 0:
+                continue  # try again when the display process releases one
+            slot = free[index].pop()
+            try:
+                copyToSlot(tile.renderMipmaps(), memory[index].buf, slot)
+            except Exception:
+                logging.warning("Exception while rendering tile %s", index, exc_info=True)
+                free[index].add(slot)
+                continue
+            published[index] = key
+            results.put((index, slot, status))
+    scheduler.stop()
+    for sharedMemory in memory.values():
+        sharedMemory.close()
+
+
+def copyToSlot(mipmap, buffer, slot):
+    # (the surfaces over the slot go away when this returns, so the shared
+    # memory can be closed later)
+    for level, target in zip(mipmap.levels, levelSurfaces(buffer, slot)):
+        target.blit(level, (0, 0))
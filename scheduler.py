@@ -0,0 +1,214 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+import heapq
+import itertools
+import logging
+import random
+import time
+import configuration
+from metrics import metrics
+
+cfg = configuration.cfg
+
+jobIDs = itertools.count(1)
+
+
+class Job:
+    def __init__(self, name, interval, function, jitter=0.0, key=None):
+        self.id = next(jobIDs)
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.jitter = jitter
+        self.key = key
+        self.base = 0.0  # un-jittered deadline, so jitter doesn't accumulate as drift
+        self.deadline = 0.0
+        self.running = False
+        self.cancelled = False
+        self.runs = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.merged = 0
+        self.totalLateness = 0.0
+        self.maxLateness = 0.0
+        self.lastDuration = 0.0
+
+    def advance(self, now):
+        self.base += self.interval
+        if self.base < now:
+            # we fell more than a whole interval behind; don't try to catch up
+            self.base = now + self.interval
+        self.deadline = self.base
+        if self.jitter > 0:
+            self.deadline += random.uniform(-self.jitter, self.jitter)
+
+
+class Scheduler:
+    # owns all periodic work (data refreshes, clock ticks, tile rotation).
+    # a single dispatcher thread keeps the jobs in deadline order and hands
+    # due jobs to a small worker pool. jobs that share a key (i.e. that hit
+    # the same endpoint) and come due within coalesceWindow seconds of each
+    # other are run back to back as one batch, and within a batch, jobs
+    # that would do the very same work (the same function) are merged into
+    # one run. a job that's still running when it comes due again is
+    # skipped rather than piling up.
+    def __init__(self, workers=4, coalesceWindow=5.0):
+        self.workers = workers
+        self.coalesceWindow = coalesceWindow
+        self.queue = []  # heap of (deadline, sequence, job)
+        self.jobs = []
+        self.sequence = itertools.count()
+        self.condition = Condition()
+        self.executor = None
+        self.thread = None
+        self.stopped = False
+
+    def every(self, interval, function, name=None, jitter=0.0, key=None, delay=None):
+        # run function every interval seconds, first after delay seconds
+        # (or after one interval if delay is None)
+        job = Job(name or getattr(function, "__qualname__", "job"), interval, function, jitter, key)
+        job.base = time.monotonic() + (interval if delay is None else delay)
+        job.deadline = job.base
+        with self.condition:
+            self.jobs.append(job)
+            heapq.heappush(self.queue, (job.deadline, next(self.sequence), job))
+            self.condition.notify()
+        return job
+
+    def once(self, delay, function, name=None, key=None):
+        # run function once, after delay seconds
+        job = Job(name or getattr(function, "__qualname__", "job"), None, function, key=key)
+        job.base = time.monotonic() + delay
+        job.deadline = job.base
+        with self.condition:
+            self.jobs.append(job)
+            heapq.heappush(self.queue, (job.deadline, next(self.sequence), job))
+            self.condition.notify()
+        return job
+
+    def cancel(self, job):
+        with self.condition:
+            job.cancelled = True
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix="scheduler")
+        self.thread = Thread(target=self.run, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    if len(self.queue) > 0:
+                        wait = self.queue[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+                if self.stopped:
+                    return
+                ready = self.takeDue(time.monotonic())
+            if len(ready) > 0:
+                self.executor.submit(self.runBatch, ready)
+
+    def takeDue(self, now):
+        # pop the next job (which must be due) and anything coalesced with
+        # it, requeue them for their next run, and return the ones to run
+        # now as [(deadline, job)], marked as running. call with the lock held.
+        deadline, sequence, job = heapq.heappop(self.queue)
+        if job.cancelled:
+            return []
+        batch = [(deadline, job)]
+        if job.key is not None:
+            batch.extend(self.takeCoalesced(job.key, now + self.coalesceWindow))
+        for jobDeadline, batchJob in batch:
+            if batchJob.interval is None:
+                # one-shot job, don't requeue it
+                if batchJob in self.jobs:
+                    self.jobs.remove(batchJob)
+                continue
+            batchJob.advance(now)
+            heapq.heappush(self.queue,
+                           (batchJob.deadline, next(self.sequence), batchJob))
+        ready = []
+        for jobDeadline, batchJob in batch:
+            if any(batchJob.function == other.function for otherDeadline, other in ready):
+                batchJob.merged += 1
+            elif batchJob.running:
+                batchJob.skipped += 1
+                logging.info("Job %s is still running, skipping this run", batchJob.name)
+            else:
+                batchJob.running = True
+                ready.append((jobDeadline, batchJob))
+        return ready
+
+    def takeCoalesced(self, key, horizon):
+        # pull queued jobs with the same key due before horizon out of the queue
+        taken = []
+        remaining = []
+        for entry in self.queue:
+            deadline, sequence, job = entry
+            if job.key == key and deadline <= horizon and not job.cancelled:
+                job.coalesced += 1
+                taken.append((deadline, job))
+            else:
+                remaining.append(entry)
+        if len(taken) > 0:
+            heapq.heapify(remaining)
+            self.queue = remaining
+        return taken
+
+    def runBatch(self, batch):
+        for deadline, job in batch:
+            start = time.monotonic()
+            lateness = max(start - deadline, 0.0)
+            try:
+                job.function()
+            except Exception:
+                logging.warning("Exception in scheduled job %s", job.name, exc_info=True)
+            finally:
+                with self.condition:
+                    job.runs += 1
+                    job.totalLateness += lateness
+                    job.maxLateness = max(job.maxLateness, lateness)
+                    job.lastDuration = time.monotonic() - start
+                    job.running = False
+                metrics.observe("shopclock_job_seconds", job.lastDuration, job=job.name)
+                metrics.observe("shopclock_job_lateness_seconds", lateness, job=job.name)
+
+    def report(self):
+        with self.condition:
+            jobs = {}
+            for job in self.jobs:
+                # several tiles of one type have jobs with the same name
+                jobs["%s#%d" % (job.name, job.id)] = {
+                    "runs": job.runs,
+                    "skipped": job.skipped,
+                    "coalesced": job.coalesced,
+                    "merged": job.merged,
+                    "meanLateness": (job.totalLateness / job.runs) if job.runs > 0 else 0.0,
+                    "maxLateness": job.maxLateness,
+                    "lastDuration": job.lastDuration}
+            return {"queueDepth": len(self.queue),
+                    "running": sum(1 for job in self.jobs if job.running),
+                    "jobs": jobs}
+
+    def logReport(self):
+        logging.info("Scheduler: %s", self.report())
+
+
+scheduler = Scheduler(cfg.get("schedulerWorkers") or 4,
+                      cfg.get("schedulerCoalesceWindow") or 5.0)
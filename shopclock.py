@@ -1,14 +1,29 @@
 #!/usr/bin/python3
 
+import math
+import os
 import sys
 import logging
 import time
 from threading import Semaphore
 import pygame
-from tiles import TextTile, CPUTemperatureTile
-from weathertiles import WeatherCurrentTile, WeatherForecastTile
-from twittertiles import RandomTweetTile
-from utils import getFont, placeTile, tupleColor, getCPUTemp, RepeatTimer
+from concurrent.futures import ThreadPoolExecutor
+from tiles import PlaceholderTile
+from tiletypes import tileTypes
+from twittertiles import tweetExecutor
+from utils import getFont, placeTile, tupleColor, getCPUTemp, scaledSurfaceCache
+from compositor import Compositor
+from clockface import GlyphAtlas, ClockText, formatCharacters
+from animation import Animation
+from prerender import Prerenderer
+from scheduler import scheduler
+from textcache import textSurfaceCache, fontLock
+from imagecache import imageCache
+from assets import assets
+from metrics import metrics, startMetricsServer
+from frameserver import FrameServer
+from renderprocess import RenderProcesses
+from profiler import installProfilerTrigger
 import configuration
 
 cfg = configuration.cfg
@@ -23,147 +38,420 @@ if logLevel is not None:
 
 # TODO: allow screen saver correctly
 
+# everything that draws runs on the main thread; other threads and timers post these
+rotateEvent = pygame.USEREVENT + 1
+tileRenderedEvent = pygame.USEREVENT + 2
+
 
 class TileManager:
     def start(self):
+        self.setup()
+        self.run()
+
+    def setup(self, tiles=None):
+        # get the display going and draw the first frame. normally the tiles
+        # are built from the config; a list of ready-made tiles can be passed
+        # in instead (e.g. by the benchmark).
+        # (drawing only happens on the main thread; this just guards the
+        # tile set while the startup threads are filling it in)
         self.renderSemaphore = Semaphore()
         self.tileSet = []
         self.lastTileImage = None
         self.mainTileImage = None
         self.nextTileImage = None
+        self.tilesDirty = True
+        self.lastAnimation = None
+        self.clockTime = None
+        self.clockDate = None
 
+        self.startTime = time.monotonic()
+        if cfg.get("headless"):
+            # nothing on a local screen; frames only go out through the frame server
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
         pygame.init()
         pygame.font.init()
-        self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        if cfg.get("fullscreen", True) and not cfg.get("headless"):
+            # (the dummy driver has no real desktop size, so headless
+            # always uses the configured geometry)
+            self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        else:
+            self.screen = pygame.display.set_mode((cfg["screenWidth"], cfg["screenHeight"]))
         pygame.mouse.set_visible(False)
-
-        for tile in cfg["tiles"]:
-            if tile["type"] == "Text":
-                self.tileSet.append(TextTile(tile))
-            elif tile["type"] == "CPUTemperature":
-                self.tileSet.append(CPUTemperatureTile(tile))
-            elif tile["type"] == "WeatherCurrent":
-                self.tileSet.append(WeatherCurrentTile(tile))
-            elif tile["type"] == "WeatherForecast":
-                self.tileSet.append(WeatherForecastTile(tile))
-            elif tile["type"] == "RandomTweet":
-                self.tileSet.append(RandomTweetTile(tile))
-            else:
-                print("Unrecognized tile type " + tile["type"] + ", skipping.")
+        self.createLayers()
+        self.frameServer = None
+        if cfg.get("frameServerPort"):
+            self.frameServer = FrameServer(self.screen,
+                                           cfg["frameServerPort"],
+                                           cfg.get("frameServerHost") or "127.0.0.1",
+                                           cfg.get("frameServerMaxClients") or 4)
+            self.frameServer.start()
+            self.compositor.addListener(self.frameServer.publish)
 
         self.currentLastTileIndex = 0
+        self.prerenderAhead = cfg.get("prerenderAhead") or 2
+        self.prerenderer = Prerenderer(self.tileSet, cfg.get("prerenderWorkers") or 2)
+        self.startupExecutor = ThreadPoolExecutor(max_workers=cfg.get("startupWorkers") or 4,
+                                                  thread_name_prefix="startup")
+        self.renderProcesses = None
+        if tiles is not None:
+            self.tileSet.extend(tiles)
+            self.startupTimings = [{"type": type(tile).__name__} for tile in tiles]
+            for tile in tiles:
+                tile.onDataUpdated = self.tileDataUpdated
+        else:
+            tileConfigs = []
+            for tile in cfg["tiles"]:
+                if tile["type"] in tileTypes:
+                    tileConfigs.append(tile)
+                else:
+                    print("Unrecognized tile type " + tile["type"] + ", skipping.")
+            self.startupTimings = [{"type": tile["type"]} for tile in tileConfigs]
+        if tiles is None and cfg.get("renderProcesses"):
+            # the real tiles live in render processes, and these stand-ins
+            # show their frames straight from shared memory
+            self.renderProcesses = RenderProcesses(tileConfigs, cfg["renderProcesses"])
+            self.tileSet.extend(self.renderProcesses.proxies)
+            for tile in self.tileSet:
+                tile.onDataUpdated = self.tileDataUpdated
+            self.renderProcesses.start()
+        elif tiles is None:
+            # start with a placeholder for every tile, and build the real tiles
+            # concurrently; each one replaces its placeholder as soon as it's ready
+            self.preloadAssets(tileConfigs)
+            for tile in tileConfigs:
+                self.tileSet.append(PlaceholderTile(tile))
+            for i in range(len(tileConfigs)):
+                self.startupExecutor.submit(self.constructTile, i, tileConfigs[i])
+        self.startupExecutor.shutdown(wait=False)
+        self.registerMetrics()
         self.createTiles()
-        self.rotateTimer = RepeatTimer(cfg["tileRefreshTime"], self.rotateTiles)
-        self.rotateTimer.start()
-        self.clockTimer = RepeatTimer(1, self.renderFull)
-        self.clockTimer.start()
-        while 1:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.stop()
-                    sys.exit()
-            time.sleep(0.200)
+        logging.info("First frame after %.3fs", time.monotonic() - self.startTime)
 
-    def stop(self):
-        pygame.mouse.set_visible(True)
+    def preloadAssets(self, tileConfigs):
+        # start decoding every image and font the tiles will ask for, in
+        # parallel; a tile that gets there first just waits for its load
+        images = []
+        fonts = []
+        if cfg["topBandHeight"] > 0:
+            fonts.append((cfg["timeDateFont"], int(cfg["topBandHeight"] * 0.9)))
+        for tile in tileConfigs:
+            tileImages, tileFonts = tileTypes[tile["type"]].declareAssets(tile)
+            images.extend(tileImages)
+            fonts.extend(tileFonts)
+        assets.preload(images, fonts)
 
-    def createTiles(self):
-        self.lastTileImage = self.tileSet[self.currentLastTileIndex].render()
-        self.mainTileImage = self.tileSet[(self.currentLastTileIndex + 1) %
-                                          len(self.tileSet)].render()
-        self.nextTileImage = self.tileSet[(self.currentLastTileIndex + 2) %
-                                          len(self.tileSet)].render()
-        self.onDeckTileImage = None
-        self.renderFull()
+    def waitForTiles(self):
+        # block until every tile has been built
+        self.startupExecutor.shutdown(wait=True)
 
-    def renderFull(self):
-        # semaphore so we don't glitch the screen in the midst of a transition animation
-        self.renderSemaphore.acquire()
-        self.render(cfg["tileSizeSmall"], cfg["tileSizeLarge"], cfg["tileSizeSmall"], 0)
-        self.renderSemaphore.release()
+    def registerMetrics(self):
+        # gauges that are read when the metrics are scraped
+        for i in range(len(self.tileSet)):
+            metrics.setGauge("shopclock_data_age_seconds",
+                             lambda i=i: self.dataAge(i),
+                             tile=self.startupTimings[i]["type"], index=i)
+        metrics.setGauge("shopclock_scale_cache_hit_ratio",
+                         lambda: scaledSurfaceCache.stats()["hitRate"])
+        metrics.setGauge("shopclock_text_cache_hit_ratio",
+                         lambda: textSurfaceCache.stats()["hitRate"])
+        metrics.setGauge("shopclock_text_cache_bytes",
+                         lambda: textSurfaceCache.stats()["bytes"])
+        metrics.setGauge("shopclock_image_cache_entries",
+                         lambda: imageCache.stats()["entries"])
+        for assetClass in ("background", "icon", "font"):
+            metrics.setGauge("shopclock_asset_bytes",
+                             lambda assetClass=assetClass: assets.residentBytes(assetClass),
+                             assetClass=assetClass)
+        metrics.setGauge("shopclock_scheduler_queue_depth",
+                         lambda: scheduler.report()["queueDepth"])
+        self.metricsOverlay = cfg.get("metricsOverlay") and self.bottomBand is not None
 
-    def render(self, lastTileSize, mainTileSize, nextTileSize, onDeckTileSize, fast=False):
-        self.screen.fill(tupleColor(cfg["backgroundColor"]))
+    def dataAge(self, index):
+        # seconds since a tile last got good data (None for tiles without data)
+        dataTime = self.tileSet[index].dataTime
+        if dataTime is None:
+            return None
+        return time.time() - dataTime
+
+    def run(self):
+        installProfilerTrigger()
+        if cfg.get("metricsPort"):
+            startMetricsServer(cfg["metricsPort"])
+        # background work (the tiles' data refreshes) runs on the scheduler
+        if cfg.get("schedulerReportInterval"):
+            scheduler.every(cfg["schedulerReportInterval"], scheduler.logReport, name="report")
+        scheduler.start()
+        # the display is driven from this thread only: the clock ticks on
+        # wall-clock second boundaries, rotation comes from a pygame timer,
+        # and re-rendered tiles arrive as events posted by the render threads
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([pygame.QUIT, rotateEvent, tileRenderedEvent])
+        pygame.time.set_timer(rotateEvent, int(cfg["tileRefreshTime"] * 1000))
+        nextTick = math.floor(time.time()) + 1
+        while True:
+            # sleep until the next second starts, or until something happens
+            timeout = nextTick - time.time()
+            events = [pygame.event.wait(max(math.ceil(timeout * 1000), 1))] if timeout > 0 else []
+            events.extend(pygame.event.get())
+            if not self.handleEvents(events):
+                break
+            now = time.time()
+            if now >= nextTick:
+                metrics.observe("shopclock_clock_tick_lateness_seconds", now - nextTick)
+                self.renderFull()
+                nextTick = math.floor(now) + 1
+            elif self.tilesDirty:
+                self.renderFull()
+        # (the events can hold rendered tiles, which stop() needs to let go of)
+        events = None
+        self.stop()
+        sys.exit()
+
+    def handleEvents(self, events):
+        # returns False once it's time to quit
+        for event in events:
+            if event.type == pygame.QUIT:
+                return False
+            elif event.type == rotateEvent:
+                self.rotateTiles()
+            elif event.type == tileRenderedEvent:
+                self.showTile(event.index, event.image)
+        return True
+
+    def stop(self):
+        pygame.time.set_timer(rotateEvent, 0)
+        scheduler.stop()
+        self.prerenderer.shutdown()
+        tweetExecutor.shutdown(wait=False)
+        if self.frameServer is not None:
+            self.frameServer.stop()
+        if self.renderProcesses is not None:
+            # let go of every frame drawn from the render processes' shared
+            # memory (on screen, queued, prerendered or scaled) so it can be
+            # closed
+            self.lastTileImage = None
+            self.mainTileImage = None
+            self.nextTileImage = None
+            self.onDeckTileImage = None
+            pygame.event.clear()
+            scaledSurfaceCache.clear()
+            self.renderProcesses.stop()
+        pygame.mouse.set_visible(True)
+
+    def createLayers(self):
+        # the screen is split into three horizontal layers that are cached
+        # offscreen and only pushed to the display when they change
+        self.compositor = Compositor(self.screen)
+        self.topBand = None
+        self.tileStrip = None
+        self.bottomBand = None
         y = 0
         if (cfg["topBandHeight"] > 0):
-            self.drawTopBand(y)
+            self.topBand = self.compositor.addLayer("topBand",
+                                                    (0, y, cfg["screenWidth"], cfg["topBandHeight"]))
             y = y + cfg["topBandHeight"]
         if (cfg["tileSizeLarge"] > 0):
-            self.drawTiles(y, lastTileSize, mainTileSize, nextTileSize, onDeckTileSize)
+            self.tileStrip = self.compositor.addLayer("tileStrip",
+                                                      (0, y, cfg["screenWidth"], cfg["tileSizeLarge"]))
             y = y + cfg["tileSizeLarge"]
         if (cfg["bottomBandHeight"] > 0):
-            self.drawBottomBand(y)
+            self.bottomBand = self.compositor.addLayer("bottomBand",
+                                                       (0, y, cfg["screenWidth"], cfg["bottomBandHeight"]))
+            self.drawBottomBand(self.bottomBand)
+        # anything not covered by a layer just gets the background color, once
+        self.screen.fill(tupleColor(cfg["backgroundColor"]))
         pygame.display.flip()
 
-    def drawTopBand(self, y):
-        self.screen.fill(tupleColor(cfg["timeDateBackgroundColor"]),
-                         rect=pygame.Rect(0, y, cfg["screenWidth"], cfg["topBandHeight"] + y))
-        font = getFont(cfg["timeDateFont"], int(cfg["topBandHeight"] * 0.9))
-        timeImage = font.render(time.strftime(cfg["timeFormat"]),
-                                True,
-                                tupleColor(cfg["timeDateColor"]),
-                                tupleColor(cfg["timeDateBackgroundColor"]))
-        self.screen.blit(timeImage, (0, y))
-        dateImage = font.render(time.strftime(cfg["dateFormat"]),
-                                True,
-                                tupleColor(cfg["timeDateColor"]),
-                                tupleColor(cfg["timeDateBackgroundColor"]))
-        self.screen.blit(dateImage, (int(cfg["screenWidth"] - dateImage.get_width()), y))
-
-    def drawBottomBand(self, y):
-        # TODO
-        pass
-
-    def drawTiles(self, y, lastTileSize, mainTileSize, nextTileSize, onDeckTileSize, fast=False):
-        vc = int(cfg["tileSizeLarge"] / 2) + y  # y coordinate of tilebox center
-        if lastTileSize > 0:
-            placeTile(self.lastTileImage,
-                      self.screen,
-                      (lastTileSize, lastTileSize),
-                      (0, int(vc - (lastTileSize / 2))),
+    def createTiles(self):
+        # render the visible tiles and the ones coming up concurrently
+        for i in range(3 + self.prerenderAhead):
+            self.prerenderer.schedule(self.currentLastTileIndex + i)
+        self.lastTileImage = self.prerenderer.take(self.currentLastTileIndex, self.tileRendered)
+        self.mainTileImage = self.prerenderer.take(self.currentLastTileIndex + 1, self.tileRendered)
+        self.nextTileImage = self.prerenderer.take(self.currentLastTileIndex + 2, self.tileRendered)
+        self.onDeckTileImage = None
+        self.tilesDirty = True
+        self.renderFull()
+
+    def constructTile(self, index, tileConfig):
+        start = time.monotonic()
+        try:
+            tile = tileTypes[tileConfig["type"]](tileConfig)
+        except Exception:
+            logging.error("Exception while creating %s tile", tileConfig["type"], exc_info=True)
+            # say so on the placeholder, and try again later
+            placeholder = self.tileSet[index]
+            placeholder.failed()
+            self.tileDataUpdated(placeholder)
+            scheduler.once(cfg.get("tileRetryInterval") or 60,
+                           lambda: self.constructTile(index, tileConfig),
+                           name="CreateTile:%s" % tileConfig["type"])
+            return
+        metrics.acquire(self.renderSemaphore, lock="TileManager")
+        try:
+            self.tileSet[index] = tile
+            tile.onDataUpdated = self.tileDataUpdated
+            timing = self.startupTimings[index]
+            timing["construct"] = time.monotonic() - start
+            timing["ready"] = time.monotonic() - self.startTime
+            allReady = all("ready" in timing for timing in self.startupTimings)
+        finally:
+            self.renderSemaphore.release()
+        logging.info("Created %s tile in %.3fs", tileConfig["type"], timing["construct"])
+        if allReady:
+            logging.info("All tiles created after %.3fs: %s",
+                         time.monotonic() - self.startTime, self.startupTimings)
+        self.tileDataUpdated(tile)
+
+    def tileDataUpdated(self, tile):
+        index = self.tileSet.index(tile)
+        timing = self.startupTimings[index]
+        if "firstData" not in timing and tile.dataTime is not None:
+            timing["firstData"] = time.monotonic() - self.startTime
+            logging.info("%s tile got its first data after %.3fs", timing["type"], timing["firstData"])
+        # re-render a tile when its data is refreshed, so a visible tile
+        # doesn't keep showing (e.g.) snapshot data until it rotates around
+        self.prerenderer.rerender(index, self.tileRendered)
+
+    def tileRendered(self, index, image):
+        # called on a render thread; hand the image to the main thread
+        pygame.event.post(pygame.event.Event(tileRenderedEvent, index=index, image=image))
+
+    def showTile(self, index, image):
+        visible = (index - self.currentLastTileIndex) % len(self.tileSet)
+        if image in (self.lastTileImage, self.mainTileImage, self.nextTileImage):
+            # the data didn't change, so neither did the render
+            return
+        if visible == 0:
+            self.lastTileImage = image
+        elif visible == 1:
+            self.mainTileImage = image
+        elif visible == 2:
+            self.nextTileImage = image
+        else:
+            return
+        self.tilesDirty = True
+
+    def renderFull(self):
+        # the clock changes every second, but the tiles only need redrawing
+        # after they've been (re)created, re-rendered or rotated
+        drawTiles = self.tilesDirty
+        if self.metricsOverlay:
+            self.drawBottomBand(self.bottomBand)
+        self.render(cfg["tileSizeSmall"], cfg["tileSizeLarge"], cfg["tileSizeSmall"], 0,
+                    drawTiles=drawTiles)
+        self.tilesDirty = False
+
+    def render(self, lastTileSize, mainTileSize, nextTileSize, onDeckTileSize, fast=False,
+               drawTiles=True):
+        if fast:
+            kind = "animation"
+        elif drawTiles:
+            kind = "full"
+        else:
+            kind = "clock"
+        with metrics.timer("shopclock_frame_seconds", kind=kind):
+            if self.topBand is not None:
+                with metrics.timer("shopclock_frame_phase_seconds", phase="drawTopBand"):
+                    self.drawTopBand(self.topBand)
+            if drawTiles and self.tileStrip is not None:
+                self.drawTiles(self.tileStrip, lastTileSize, mainTileSize, nextTileSize,
+                               onDeckTileSize, fast)
+            with metrics.timer("shopclock_frame_phase_seconds", phase="present"):
+                self.compositor.present()
+
+    def drawTopBand(self, layer):
+        if self.clockTime is None:
+            # first time through: build the glyph atlas and clear the band
+            font = getFont(cfg["timeDateFont"], int(cfg["topBandHeight"] * 0.9))
+            fixedDigits = cfg.get("timeDateFixedDigits")
+            atlas = GlyphAtlas(font,
+                               tupleColor(cfg["timeDateColor"]),
+                               tupleColor(cfg["timeDateBackgroundColor"]),
+                               formatCharacters(cfg["timeFormat"], cfg["dateFormat"]),
+                               True if fixedDigits is None else fixedDigits)
+            self.clockTime = ClockText(atlas)
+            self.clockDate = ClockText(atlas)
+            layer.surface.fill(tupleColor(cfg["timeDateBackgroundColor"]))
+            layer.invalidate()
+        # only the characters that changed since last time get redrawn
+        for rect in self.clockTime.draw(layer.surface, time.strftime(cfg["timeFormat"]), 0, 0):
+            layer.invalidate(rect)
+        for rect in self.clockDate.draw(layer.surface, time.strftime(cfg["dateFormat"]),
+                                        cfg["screenWidth"], 0, alignRight=True):
+            layer.invalidate(rect)
+
+    def drawBottomBand(self, layer):
+        # TODO: status icons. for now this can show a performance overlay.
+        layer.surface.fill(tupleColor(cfg["backgroundColor"]))
+        if cfg.get("metricsOverlay"):
+            text = []
+            for label, name, labels in (("frame", "shopclock_frame_seconds", {"kind": "clock"}),
+                                        ("anim", "shopclock_frame_seconds", {"kind": "animation"}),
+                                        ("tiles", "shopclock_frame_phase_seconds", {"phase": "placeTile"}),
+                                        ("flip", "shopclock_frame_phase_seconds", {"phase": "present"})):
+                histogram = metrics.histogram(name, **labels)
+                if histogram is not None:
+                    text.append("%s %.1f/%.1f ms" % (label,
+                                                     histogram.percentile(0.5) * 1000,
+                                                     histogram.percentile(0.95) * 1000))
+            stats = scaledSurfaceCache.stats()
+            text.append("scale hits %.0f%%" % (stats["hitRate"] * 100))
+            font = getFont(cfg["timeDateFont"], max(int(cfg["bottomBandHeight"] * 0.6), 8))
+            with fontLock:
+                textImage = font.render("  ".join(text), True, tupleColor(cfg["timeDateColor"]))
+            layer.surface.blit(textImage, (0, int((layer.rect.height - textImage.get_height()) / 2)))
+        layer.invalidate()
+
+    def drawTiles(self, layer, lastTileSize, mainTileSize, nextTileSize, onDeckTileSize, fast=False):
+        with metrics.timer("shopclock_frame_phase_seconds", phase="fill"):
+            layer.surface.fill(tupleColor(cfg["backgroundColor"]))
+        with metrics.timer("shopclock_frame_phase_seconds", phase="placeTile"):
+            vc = int(cfg["tileSizeLarge"] / 2)  # y coordinate of tilebox center
+            if lastTileSize > 0:
+                placeTile(self.lastTileImage,
+                          layer.surface,
+                          (lastTileSize, lastTileSize),
+                          (0, int(vc - (lastTileSize / 2))),
+                          fast)
+            placeTile(self.mainTileImage,
+                      layer.surface,
+                      (mainTileSize, mainTileSize),
+                      (lastTileSize, int(vc - (mainTileSize / 2))),
                       fast)
-        placeTile(self.mainTileImage,
-                  self.screen,
-                  (mainTileSize, mainTileSize),
-                  (lastTileSize, int(vc - (mainTileSize / 2))),
-                  fast)
-        placeTile(self.nextTileImage,
-                  self.screen,
-                  (nextTileSize, nextTileSize),
-                  (lastTileSize + mainTileSize,
-                   int(vc - (nextTileSize / 2))),
-                  fast)
-        if onDeckTileSize > 0 and self.onDeckTileImage is not None:
-            placeTile(self.onDeckTileImage,
-                      self.screen,
-                      (onDeckTileSize, onDeckTileSize),
-                      (lastTileSize + mainTileSize + nextTileSize,
-                       int(vc - (onDeckTileSize / 2))),
+            placeTile(self.nextTileImage,
+                      layer.surface,
+                      (nextTileSize, nextTileSize),
+                      (lastTileSize + mainTileSize,
+                       int(vc - (nextTileSize / 2))),
                       fast)
+            if onDeckTileSize > 0 and self.onDeckTileImage is not None:
+                placeTile(self.onDeckTileImage,
+                          layer.surface,
+                          (onDeckTileSize, onDeckTileSize),
+                          (lastTileSize + mainTileSize + nextTileSize,
+                           int(vc - (onDeckTileSize / 2))),
+                          fast)
+        layer.invalidate()
 
     def rotateTiles(self):
-        # semaphore so another timer doesn't glitch the screen in the midst of the animation
-        self.renderSemaphore.acquire()
-        # animate the transition
-        self.onDeckTileImage = self.tileSet[(
-            self.currentLastTileIndex + 3) % len(self.tileSet)].render()
-        lastTileSize = float(cfg["tileSizeSmall"])
-        mainTileSize = float(cfg["tileSizeLarge"])
-        nextTileSize = float(cfg["tileSizeSmall"])
-        onDeckTileSize = 0.0
-        stepSizeSmall = cfg["tileSizeSmall"] / cfg["animationSteps"]
-        stepSizeLarge = (cfg["tileSizeLarge"] - cfg["tileSizeSmall"]) / \
-            cfg["animationSteps"]
-        for i in range(cfg["animationSteps"]):
-            lastTileSize -= stepSizeSmall
-            mainTileSize -= stepSizeLarge
-            nextTileSize += stepSizeLarge
-            onDeckTileSize += stepSizeSmall
-            self.render(int(lastTileSize),
-                        int(mainTileSize),
-                        int(nextTileSize),
-                        int(onDeckTileSize),
+        # the tile coming on deck was rendered ahead of time in the background
+        self.onDeckTileImage = self.prerenderer.take(self.currentLastTileIndex + 3, self.tileRendered)
+        # animate the transition. every frame redraws the top band too, so
+        # the clock keeps ticking during the animation.
+        small = cfg["tileSizeSmall"]
+        large = cfg["tileSizeLarge"]
+        animation = Animation(cfg.get("animationDuration") or 0.75,
+                              cfg.get("animationFPS") or 30,
+                              cfg.get("animationEasing") or "easeInOutQuad")
+        for progress in animation.frames():
+            self.render(int(small * (1.0 - progress)),
+                        int(large - ((large - small) * progress)),
+                        int(small + ((large - small) * progress)),
+                        int(small * progress),
                         fast=True)
+        self.lastAnimation = animation
+        logging.info("Tile rotation: %s", animation.report())
         # update the tile references
         self.lastTileImage = self.mainTileImage
         self.mainTileImage = self.nextTileImage
@@ -171,7 +459,13 @@ class TileManager:
         self.onDeckTileImage = None
         # update the tile index
         self.currentLastTileIndex = (self.currentLastTileIndex + 1) % len(self.tileSet)
-        self.renderSemaphore.release()
+        self.tilesDirty = True
+        # start rendering the tiles that will come on deck next
+        for i in range(self.prerenderAhead):
+            self.prerenderer.schedule(self.currentLastTileIndex + 3 + i)
+        logging.debug("Scaled surface cache: %s", scaledSurfaceCache.stats())
+        logging.debug("Tile render latency: %s", self.prerenderer.stats())
+        logging.debug("Text surface cache: %s", textSurfaceCache.stats())
         # render one last time so the non-animated image has the good resampling filter
         self.renderFull()
 
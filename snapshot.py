@@ -0,0 +1,65 @@
+from threading import Lock
+import fcntl
+import json
+import logging
+import os
+import time
+import configuration
+
+cfg = configuration.cfg
+
+
+class SnapshotStore:
+    # keeps the last good payload for each data tile in one small JSON file,
+    # so tiles can draw something useful at startup before the network
+    # has answered. each entry is stored with the time it was saved.
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.entries = None
+
+    def loadFile(self):
+        if self.entries is not None:
+            return
+        try:
+            with open(self.path) as file:
+                self.entries = json.load(file)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception:
+            logging.warning("Couldn't read snapshot file %s, ignoring it", self.path, exc_info=True)
+            self.entries = {}
+
+    def load(self, key):
+        # returns (payload, savedAt) or (None, None)
+        with self.lock:
+            self.loadFile()
+            entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+        return entry.get("payload"), entry.get("savedAt")
+
+    def save(self, key, payload):
+        with self.lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # render processes save to the same file, so hold a lock
+                # file across re-reading it and writing it back, or one
+                # process could write over another's new entry
+                with open(self.path + ".lock", "w") as lockFile:
+                    fcntl.flock(lockFile, fcntl.LOCK_EX)
+                    self.entries = None
+                    self.loadFile()
+                    self.entries[key] = {"savedAt": time.time(), "payload": payload}
+                    # write and rename so a crash can't leave a half-written file
+                    temporaryPath = "%s.%d.tmp" % (self.path, os.getpid())
+                    with open(temporaryPath, "w") as file:
+                        json.dump(self.entries, file)
+                    os.replace(temporaryPath, self.path)
+            except Exception:
+                logging.warning("Couldn't write snapshot file %s", self.path, exc_info=True)
+
+
+snapshots = SnapshotStore(cfg.get("snapshotFile") or "cache/snapshot.json")
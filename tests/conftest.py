@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules live at the top of the repo and read their config on import
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.environ.setdefault("SHOPCLOCK_CONFIG", os.path.join(root, "shopclock-config-sample.yaml"))
@@ -0,0 +1,124 @@
+import time
+from scheduler import Job, Scheduler
+
+
+def noop():
+    pass
+
+
+def other():
+    pass
+
+
+def test_advance_keeps_the_interval_without_drift():
+    job = Job("job", 10.0, noop)
+    job.base = 100.0
+    job.advance(105.0)
+    assert job.base == 110.0
+    assert job.deadline == 110.0
+    job.advance(112.0)
+    assert job.base == 120.0
+
+
+def test_advance_skips_ahead_when_far_behind():
+    job = Job("job", 10.0, noop)
+    job.base = 100.0
+    job.advance(135.0)
+    assert job.base == 145.0
+
+
+def test_jitter_stays_off_the_base():
+    job = Job("job", 10.0, noop, jitter=2.0)
+    job.base = 100.0
+    for i in range(20):
+        job.advance(job.base)
+        assert abs(job.deadline - job.base) <= 2.0
+    assert job.base == 300.0
+
+
+def test_due_job_is_requeued_and_marked_running():
+    scheduler = Scheduler(coalesceWindow=5.0)
+    job = scheduler.every(60.0, noop, delay=0)
+    now = time.monotonic()
+    ready = scheduler.takeDue(now)
+    assert [readyJob for deadline, readyJob in ready] == [job]
+    assert job.running
+    assert len(scheduler.queue) == 1
+    assert scheduler.queue[0][2] is job
+    assert scheduler.queue[0][0] > now
+
+
+def test_jobs_with_the_same_key_are_coalesced_within_the_window():
+    scheduler = Scheduler(coalesceWindow=5.0)
+    first = scheduler.every(60.0, noop, key="api", delay=0)
+    soon = scheduler.every(60.0, other, key="api", delay=2.0)
+    later = scheduler.every(60.0, other, key="api", delay=30.0)
+    unrelated = scheduler.every(60.0, other, key="elsewhere", delay=1.0)
+    ready = scheduler.takeDue(time.monotonic())
+    assert [job for deadline, job in ready] == [first, soon]
+    assert soon.coalesced == 1
+    assert not later.running
+    assert not unrelated.running
+    assert len(scheduler.queue) == 4
+
+
+def test_duplicate_work_in_a_batch_is_merged():
+    scheduler = Scheduler(coalesceWindow=5.0)
+    first = scheduler.every(60.0, noop, key="api", delay=0)
+    duplicate = scheduler.every(60.0, noop, key="api", delay=1.0)
+    ready = scheduler.takeDue(time.monotonic())
+    assert [job for deadline, job in ready] == [first]
+    assert duplicate.merged == 1
+    assert not duplicate.running
+
+
+def test_running_job_is_skipped():
+    scheduler = Scheduler()
+    job = scheduler.every(60.0, noop, delay=0)
+    job.running = True
+    assert scheduler.takeDue(time.monotonic()) == []
+    assert job.skipped == 1
+    assert len(scheduler.queue) == 1
+
+
+def test_one_shot_job_is_not_requeued():
+    scheduler = Scheduler()
+    job = scheduler.once(0, noop)
+    ready = scheduler.takeDue(time.monotonic())
+    assert [readyJob for deadline, readyJob in ready] == [job]
+    assert scheduler.queue == []
+    assert job not in scheduler.jobs
+
+
+def test_cancelled_job_is_dropped():
+    scheduler = Scheduler()
+    job = scheduler.every(60.0, noop, delay=0)
+    scheduler.cancel(job)
+    assert scheduler.takeDue(time.monotonic()) == []
+    assert scheduler.queue == []
+
+
+def test_run_batch_records_runs_and_survives_exceptions():
+    scheduler = Scheduler()
+    calls = []
+
+    def fail():
+        calls.append("fail")
+        raise RuntimeError("boom")
+
+    failing = scheduler.every(60.0, fail, delay=0)
+    working = scheduler.every(60.0, lambda: calls.append("work"), delay=0)
+    ready = scheduler.takeDue(time.monotonic()) + scheduler.takeDue(time.monotonic())
+    scheduler.runBatch(ready)
+    assert calls == ["fail", "work"]
+    assert failing.runs == 1 and not failing.running
+    assert working.runs == 1 and not working.running
+
+
+def test_report_keeps_jobs_with_the_same_name_apart():
+    scheduler = Scheduler()
+    scheduler.every(60.0, noop, name="Tile")
+    scheduler.every(60.0, other, name="Tile")
+    report = scheduler.report()
+    assert len(report["jobs"]) == 2
+    assert report["queueDepth"] == 2
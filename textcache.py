@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from threading import Lock, RLock
+import configuration
+
+cfg = configuration.cfg
+
+# SDL_ttf isn't thread-safe, and tiles render on several threads at once,
+# so anything that opens, renders with or measures a Font holds this
+fontLock = RLock()
+
+
+def surfaceBytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class TextSurfaceCache:
+    # rendered text surfaces shared by every tile, keyed by font, text and
+    # color, and bounded by the total size of the pixel data. surfaces
+    # handed out by the cache are shared, so callers must only blit from
+    # them, never draw on them.
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            surface = self.entries.get(key)
+            if surface is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return surface
+
+    def put(self, key, surface):
+        size = surfaceBytes(surface)
+        if size > self.maxBytes:
+            return surface
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= surfaceBytes(old)
+            self.entries[key] = surface
+            self.bytes += size
+            while self.bytes > self.maxBytes:
+                oldKey, oldSurface = self.entries.popitem(last=False)
+                self.bytes -= surfaceBytes(oldSurface)
+        return surface
+
+    def render(self, font, text, color, background=None):
+        key = ("text", font, text, color, background)
+        surface = self.get(key)
+        if surface is None:
+            # render outside the cache lock so lookups aren't held up
+            with fontLock:
+                surface = font.render(text, True, color, background)
+            surface = self.put(key, surface)
+        return surface
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "bytes": self.bytes,
+                    "maxBytes": self.maxBytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hitRate": (self.hits / lookups) if lookups > 0 else 0.0}
+
+
+textSurfaceCache = TextSurfaceCache(cfg.get("textCacheMaxBytes") or 8 * 1024 * 1024)
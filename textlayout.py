@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from threading import Lock
+from textcache import fontLock
+
+
+class Layout:
+    # the result of wrapping some text: the lines, the width of each line
+    # in pixels as rendered, and the overall size of the block. lines are
+    # lineHeight apart, which is the height of a rendered line.
+    def __init__(self, lines, widths, lineHeight):
+        self.lines = lines
+        self.widths = widths
+        self.lineHeight = lineHeight
+        self.width = max(widths) if len(widths) > 0 else 0
+        self.height = lineHeight * len(lines)
+
+
+class TextLayoutEngine:
+    # greedy line breaker. each distinct word (and the space) is measured
+    # once per font and remembered, and line breaks are found by adding up
+    # those widths, so wrapping is linear in the length of the text. each
+    # finished line is then measured once as a whole, so the widths in the
+    # layout include kerning and match the rendered lines. finished
+    # layouts are cached so laying out the same text again is just a lookup.
+    def __init__(self, maxWordsPerFont=4096, maxLayouts=256):
+        self.maxWordsPerFont = maxWordsPerFont
+        self.maxLayouts = maxLayouts
+        self.wordWidths = {}  # font -> {word: width}
+        self.layouts = OrderedDict()  # (font, text, wrapWidth) -> Layout
+        self.lock = Lock()
+
+    def measure(self, font, word):
+        widths = self.wordWidths.get(font)
+        if widths is None:
+            widths = {}
+            self.wordWidths[font] = widths
+        width = widths.get(word)
+        if width is None:
+            if len(widths) >= self.maxWordsPerFont:
+                widths.clear()
+            with fontLock:
+                width = font.size(word)[0]
+            widths[word] = width
+        return width
+
+    def wrap(self, font, text, wrapWidth):
+        # break on spaces to fit wrapWidth, keeping any newlines already in
+        # the text. spaces at a break are dropped; other spaces are kept as
+        # they are. a word too long for a line goes on a line by itself (and
+        # gets clipped when drawn); an empty line is laid out as " " so it
+        # still takes up a line's worth of height.
+        key = (font, text, wrapWidth)
+        with self.lock:
+            layout = self.layouts.get(key)
+            if layout is not None:
+                self.layouts.move_to_end(key)
+                return layout
+            spaceWidth = self.measure(font, " ")
+            lines = []
+            widths = []
+
+            def finishLine(words):
+                line = " ".join(words).rstrip(" ") or " "
+                lines.append(line)
+                with fontLock:
+                    widths.append(font.size(line)[0])
+
+            for paragraph in text.split("\n"):
+                words = []  # "" is an extra space between two words
+                lineWidth = 0
+                for word in paragraph.split(" "):
+                    if len(words) == 0:
+                        if word != "":
+                            words.append(word)
+                            lineWidth = self.measure(font, word)
+                        continue
+                    wordWidth = self.measure(font, word) if word != "" else 0
+                    if word == "" or lineWidth + spaceWidth + wordWidth <= wrapWidth:
+                        words.append(word)
+                        lineWidth += spaceWidth + wordWidth
+                    else:
+                        finishLine(words)
+                        words = [word]
+                        lineWidth = wordWidth
+                finishLine(words)
+            with fontLock:
+                lineHeight = font.get_height()
+            layout = Layout(lines, widths, lineHeight)
+            self.layouts[key] = layout
+            while len(self.layouts) > self.maxLayouts:
+                self.layouts.popitem(last=False)
+            return layout
+
+
+textLayoutEngine = TextLayoutEngine()
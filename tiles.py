@@ -1,8 +1,11 @@
-from threading import Timer
-import logging
+import time
 import pygame
 import configuration
-from utils import getFont, placeTile, tupleColor, getCPUTemp, flattenString, RepeatTimer
+from textlayout import textLayoutEngine
+from textcache import textSurfaceCache
+from metrics import metrics
+from assets import assets
+from utils import getFont, placeTile, tupleColor, getCPUTemp, flattenString, Mipmap
 
 cfg = configuration.cfg
 
@@ -13,14 +16,70 @@ class Tile:
         self.backgroundColor = tupleColor(tile.get("backgroundColor")) or tupleColor("#000000")
         self.backgroundImageName = tile.get("backgroundImage") or None
         if self.backgroundImageName is not None:
-            self.backgroundImage = pygame.transform.smoothscale(pygame.image.load("images/" + self.backgroundImageName).convert(),
-                                                                (cfg["tileSizeLarge"],
-                                                                 cfg["tileSizeLarge"]))
+            # shared with any other tile using the same image; render() copies it
+            self.backgroundImage = assets.image("images/" + self.backgroundImageName,
+                                                (cfg["tileSizeLarge"], cfg["tileSizeLarge"]),
+                                                assetClass="background")
         else:
             self.backgroundImage = None
         self.fontName = tile.get("font") or "Ubuntu-Regular"
         self.fontSize = tile.get("fontSize") or 36
         self.font = getFont(self.fontName, self.fontSize)
+        # data tiles keep these up to date; see dataUpdated()
+        self.serviceError = False
+        self.stale = False
+        self.dataTime = None
+        self.onDataUpdated = None
+        # data tiles bump dataVersion whenever the data they draw changes, so
+        # renderMipmaps can hand back the last render while nothing has
+        self.dataVersion = 0
+        self.lastRender = None  # (renderKey, Mipmap)
+
+    @classmethod
+    def declareAssets(cls, tile):
+        # the images and fonts a tile with this config will load, so they can
+        # be preloaded in parallel at startup; returns (images, fonts) in the
+        # form AssetManager.preload() takes
+        images = []
+        if tile.get("backgroundImage"):
+            images.append({"path": "images/" + tile["backgroundImage"],
+                           "size": (cfg["tileSizeLarge"], cfg["tileSizeLarge"]),
+                           "assetClass": "background"})
+        fontName = tile.get("font") or "Ubuntu-Regular"
+        fonts = [(fontName, tile.get("fontSize") or 36), (fontName, 14)]
+        return images, fonts
+
+    def dataUpdated(self):
+        # called by data tiles after a successful refresh
+        self.serviceError = False
+        self.stale = False
+        self.dataTime = time.time()
+        metrics.increment("shopclock_refresh_total", tile=type(self).__name__, result="success")
+        if self.onDataUpdated is not None:
+            self.onDataUpdated(self)
+
+    def refreshFailed(self):
+        # called by data tiles when a refresh fails; the old data stays up
+        self.serviceError = True
+        metrics.increment("shopclock_refresh_total", tile=type(self).__name__, result="failure")
+
+    def hydrated(self, savedAt):
+        # called by data tiles after loading data from a snapshot at startup
+        self.stale = True
+        self.dataTime = savedAt
+
+    def drawStatusIndicators(self, image):
+        # red X if the last refresh failed; "as of" time if we're still
+        # showing data from a previous run
+        if self.serviceError:
+            errorIndicator = self.renderText("X", color=tupleColor("#FF0000"))
+            image.blit(errorIndicator, (0, 0))
+        if self.stale and self.dataTime is not None:
+            staleIndicator = self.renderText(time.strftime("as of %I:%M %p",
+                                                           time.localtime(self.dataTime)),
+                                             font=getFont(self.fontName, 14),
+                                             color=tupleColor("#FF8000"))
+            image.blit(staleIndicator, (image.get_width() - staleIndicator.get_width(), 0))
 
     def render(self):
         if self.backgroundImage is None:
@@ -30,17 +89,42 @@ class Tile:
             image = self.backgroundImage.copy()
         return image
 
+    def renderKey(self):
+        # everything the rendered image depends on; tiles that draw anything
+        # else (the time of day, a sensor reading) add it to the key
+        return (self.dataVersion, self.serviceError, self.stale)
+
+    def renderMipmaps(self):
+        # render the tile and pre-scale it for display at smaller sizes,
+        # unless nothing it depends on has changed since the last time
+        key = self.renderKey()
+        lastRender = self.lastRender
+        if lastRender is not None and lastRender[0] == key:
+            metrics.increment("shopclock_tile_render_memo_total", tile=type(self).__name__, result="hit")
+            return lastRender[1]
+        metrics.increment("shopclock_tile_render_memo_total", tile=type(self).__name__, result="miss")
+        with metrics.timer("shopclock_tile_render_seconds", tile=type(self).__name__):
+            image = self.render()
+        with metrics.timer("shopclock_tile_mipmap_seconds", tile=type(self).__name__):
+            mipmap = Mipmap(image)
+        self.lastRender = (key, mipmap)
+        return mipmap
+
     def renderText(self, text, **kwargs):
         font = kwargs.get("font") or self.font
         color = kwargs.get("color") or self.textColor
         flattenedText = flattenString(text)
         if "\n" in flattenedText:
             return self.renderMultilineText(flattenedText.split("\n"), font=font, color=color)
-        return font.render(flattenedText, True, color)
+        return textSurfaceCache.render(font, flattenedText, color)
 
     def renderMultilineText(self, lines, **kwargs):
         font = kwargs.get("font") or self.font
         color = kwargs.get("color") or self.textColor
+        key = ("lines", font, tuple(lines), color)
+        image = textSurfaceCache.get(key)
+        if image is not None:
+            return image
         # render each line
         textImages = []
         height = 0
@@ -58,92 +142,49 @@ class Tile:
         for textImage in textImages:
             image.blit(textImage, (0, y))
             y = y + textImage.get_height()
-        return image
+        return textSurfaceCache.put(key, image)
 
     def renderWrappedText(self, text, wrapWidth, **kwargs):
-        # split the string to wrap it to the given width
-        # and then pass to renderMultilineText
-        # note that this splits strictly on spaces, and
-        # preserves any newlines already in the string.
+        # wrap the string to the given width and draw the lines from the
+        # layout, which already knows how big each one is. note that this
+        # splits strictly on spaces, and preserves any newlines already in
+        # the string.
         font = kwargs.get("font") or self.font
         color = kwargs.get("color") or self.textColor
-        lines = []
-        done = False
-        lastLength = -1
-        logging.info("Wrapping text to %s pixels:\n%s" %
-                     (wrapWidth, text))
-        while not done:
-            # if lastLength == len(text):
-            #    logging.error("Infinite loop!")
-            #    return None
-            # lastLength = len(text)
-            # if text now starts with one or more hard line breaks,
-            # render them by putting a " " in the array for each one
-            while text.startswith("\n"):
-                lines.append(" ")
-                text = text[1:]
-            # find the longest string that will fit in the width
-            width = 0
-            firstSpace = None
-            secondSpace = None
-            logging.info("Seeking: %s" % text)
-            while width < wrapWidth and not done:
-                # if firstSpace is not None and secondSpace is not None and firstSpace == secondSpace:
-                #    logging.error("Infinite loop!!")
-                #    return None
-                firstSpace = secondSpace
-                if firstSpace is not None:
-                    secondSpace = text.find(" ", firstSpace + 1)
-                else:
-                    secondSpace = text.find(" ")
-                hardLineBreak = text.find("\n")
-                if secondSpace == -1:
-                    done = True
-                elif hardLineBreak >= 0 and \
-                        firstSpace is not None and \
-                        hardLineBreak > firstSpace and \
-                        hardLineBreak < secondSpace:
-                    break
-                else:
-                    logging.info("Sizing: %s" % text[:secondSpace])
-                    width, height = font.size(text[:secondSpace])
-                    logging.info("width = %s" % width)
-            if done:
-                logging.info("End of line.")
-                lines.append(text.strip(" "))
-            elif hardLineBreak >= 0 and \
-                    firstSpace is not None and \
-                    hardLineBreak > firstSpace and \
-                    hardLineBreak < secondSpace:
-                logging.info("Hard line break...")
-                # here if we hit a hard line break before a soft break
-                # we still need to check to see whether the line will fit
-                # if we break it at the hard break
-                hbWidth, hbHeight = font.size(text[:hardLineBreak])
-                if hbWidth > wrapWidth:
-                    # nope
-                    logging.info("Broke before hard break.")
-                    lines.append(text[:firstSpace].strip(" "))
-                    text = text[firstSpace:].strip(" ")
-                else:
-                    # yup
-                    logging.info("Broke at hard break.")
-                    lines.append(text[:hardLineBreak].strip(" "))
-                    text = text[hardLineBreak:].strip(" ")
-            elif firstSpace is None:
-                logging.info("Word too long!")
-                # here if the first segment is too long to begin with
-                # in that case, just add it as is and let it clip off
-                lines.append(text[:secondSpace].strip(" "))
-                text = text[secondSpace:].strip(" ")
-            else:
-                logging.info("Soft line break.")
-                # here if going to the second space would put us over,
-                # so break at the first space
-                lines.append(text[:firstSpace].strip(" "))
-                text = text[firstSpace:].strip(" ")
-            logging.info("Added line: %s" % lines[len(lines) - 1])
-        return self.renderMultilineText(lines, font=font, color=color)
+        layout = textLayoutEngine.wrap(font, flattenString(text), wrapWidth)
+        key = ("layout", font, tuple(layout.lines), color)
+        image = textSurfaceCache.get(key)
+        if image is not None:
+            return image
+        image = pygame.Surface((max(layout.width, 1), max(layout.height, 1)), pygame.SRCALPHA)
+        for i in range(len(layout.lines)):
+            if layout.lines[i].strip() != "":
+                image.blit(textSurfaceCache.render(font, layout.lines[i], color),
+                           (0, i * layout.lineHeight))
+        return textSurfaceCache.put(key, image)
+
+
+class PlaceholderTile(Tile):
+    # stands in for a tile while the real one is still being created
+    def __init__(self, tile):
+        # skip the background image; loading it is part of what we're waiting for
+        super().__init__({key: value for key, value in tile.items() if key != "backgroundImage"})
+        self.title = tile.get("title") or tile["type"]
+        self.text = self.title + "\n\nLoading..."
+
+    def failed(self):
+        # creating the real tile failed; it'll be tried again later
+        self.text = self.title + "\n\nUnavailable"
+        self.serviceError = True
+        self.dataVersion += 1
+
+    def render(self):
+        image = super().render()
+        textImage = super().renderText(self.text)
+        image.blit(textImage, (int((image.get_width() - textImage.get_width()) / 2),
+                               int((image.get_height() - textImage.get_height()) / 2)))
+        self.drawStatusIndicators(image)
+        return image
 
 
 class TextTile(Tile):
@@ -162,8 +203,17 @@ class TextTile(Tile):
 class CPUTemperatureTile(Tile):
     def __init__(self, tile):
         super().__init__(tile)
-        self.icon = pygame.transform.smoothscale(pygame.image.load("images/thermometer.png").convert_alpha(),
-                                                 (150, 150))
+        self.icon = assets.image("images/thermometer.png", (150, 150), alpha=True, assetClass="icon")
+
+    @classmethod
+    def declareAssets(cls, tile):
+        images, fonts = super().declareAssets(tile)
+        images.append({"path": "images/thermometer.png", "size": (150, 150), "alpha": True,
+                       "assetClass": "icon"})
+        return images, fonts
+
+    def renderKey(self):
+        return super().renderKey() + getCPUTemp()
 
     def render(self):
         tempC, tempF = getCPUTemp()
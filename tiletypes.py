@@ -0,0 +1,12 @@
+from tiles import TextTile, CPUTemperatureTile
+from weathertiles import WeatherCurrentTile, WeatherForecastTile
+from twittertiles import RandomTweetTile
+
+# tile "type" in the config -> the class that implements it
+tileTypes = {
+    "Text": TextTile,
+    "CPUTemperature": CPUTemperatureTile,
+    "WeatherCurrent": WeatherCurrentTile,
+    "WeatherForecast": WeatherForecastTile,
+    "RandomTweet": RandomTweetTile,
+}
@@ -1,14 +1,18 @@
-from io import BytesIO
-from threading import Semaphore
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, Semaphore
 import logging
 import random
 import json
-import requests
-import pygame
-import tweepy
+import time
 import configuration
+from datasource import twitter
 from tiles import Tile
-from utils import getFont, placeTile, tupleColor, getCPUTemp, flattenString, RepeatTimer
+from imagecache import imageCache
+from scheduler import scheduler
+from metrics import metrics
+from snapshot import snapshots
+from utils import getFont, placeTile, tupleColor, getCPUTemp, flattenString
 
 cfg = configuration.cfg
 
@@ -18,6 +22,131 @@ cfg = configuration.cfg
 # TODO: display full tweets, not truncated tweets (?)
 # TODO: display picture if attached to tweet
 
+# runs the searches and photo prefetches for every tile's pool; shut down
+# by TileManager.stop()
+tweetExecutor = ThreadPoolExecutor(max_workers=cfg.get("twitterWorkers") or 4,
+                                   thread_name_prefix="tweetpool")
+
+
+class TweetPool:
+    # candidate tweets for one tile, so picking a new tweet doesn't cost
+    # any round trips. refill() runs all the searches at once, gets the
+    # full statuses for the new candidates in one lookup and prefetches
+    # their authors' profile photos. take() hands out a random candidate
+    # and queues a background refill when the pool runs low. candidates
+    # are deduplicated by ID, expire after ttl seconds, and recently
+    # shown tweets aren't brought back while there's anything else. only
+    # one refill runs at a time; anyone else who asks for one waits for it.
+    def __init__(self, name, searches, query, language, resultType, perSearch,
+                 maxSize=50, ttl=3600, lowWater=5):
+        self.name = name
+        self.searches = searches
+        self.query = query
+        self.language = language
+        self.resultType = resultType
+        self.perSearch = perSearch
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.lowWater = lowWater
+        self.candidates = OrderedDict()  # tweet ID -> (status JSON, time fetched), oldest first
+        self.shown = deque(maxlen=maxSize)
+        self.lock = Lock()
+        self.refilling = None  # Future for the refill in progress
+        self.refillQueued = False
+
+    def take(self):
+        # a random unexpired candidate, or None if the pool is empty
+        now = time.time()
+        status = None
+        with self.lock:
+            while len(self.candidates) > 0:
+                id, (candidate, fetchedAt) = next(iter(self.candidates.items()))
+                if now - fetchedAt <= self.ttl:
+                    break
+                del self.candidates[id]
+            if len(self.candidates) > 0:
+                id = random.choice(list(self.candidates))
+                status, fetchedAt = self.candidates.pop(id)
+                self.shown.append(id)
+            queueRefill = len(self.candidates) < self.lowWater and not self.refillQueued
+            if queueRefill:
+                self.refillQueued = True
+        if queueRefill:
+            scheduler.once(0, self.backgroundRefill, name="TweetPool:%s" % self.name, key="twitter")
+        return status
+
+    def backgroundRefill(self):
+        with self.lock:
+            self.refillQueued = False
+            if len(self.candidates) >= self.lowWater or self.refilling is not None:
+                return  # someone else already refilled it, or is doing so
+        try:
+            self.refill()
+        except Exception:
+            logging.warning("Exception while refilling the tweet pool for %s", self.name, exc_info=True)
+
+    def refill(self):
+        with self.lock:
+            future = self.refilling
+            refiller = future is None
+            if refiller:
+                future = Future()
+                self.refilling = future
+        if not refiller:
+            # one's already in progress; wait for it (and its errors)
+            return future.result()
+        try:
+            self.fetchCandidates()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            with self.lock:
+                self.refilling = None
+
+    def fetchCandidates(self):
+        searches = {tweetExecutor.submit(twitter.search, self.query % search, self.language,
+                                         self.resultType, self.perSearch): search
+                    for search in self.searches}
+        results = []
+        error = None
+        for future, search in searches.items():
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                logging.warning("Exception while running twitter query: %s", self.query % search,
+                                exc_info=True)
+                error = e
+        if error is not None and len(results) == 0:
+            raise error
+        with self.lock:
+            room = self.maxSize - len(self.candidates)
+            # prefer tweets we haven't shown recently, but if that's all
+            # the searches have, show them again rather than nothing
+            ids = list(OrderedDict.fromkeys(tweet["id_str"] for tweet in results
+                                            if tweet["id_str"] not in self.candidates))
+            unseen = [id for id in ids if id not in self.shown]
+            if len(unseen) > 0:
+                ids = unseen
+        random.shuffle(ids)
+        ids = ids[:room]
+        statuses = []
+        for i in range(0, len(ids), 100):
+            statuses.extend(twitter.lookupStatuses(ids[i:i + 100]))
+        urls = {status["user"]["profile_image_url_https"] for status in statuses
+                if status.get("user") is not None}
+        list(tweetExecutor.map(imageCache.prefetch, urls))
+        now = time.time()
+        with self.lock:
+            for status in statuses:
+                self.candidates[status["id_str"]] = (status, now)
+            while len(self.candidates) > self.maxSize:
+                self.candidates.popitem(last=False)
+        logging.info("Tweet pool for %s refilled with %d tweets from %d searches",
+                     self.name, len(statuses), len(self.searches))
+
 
 class RandomTweetTile(Tile):
     def __init__(self, tile):
@@ -29,60 +158,67 @@ class RandomTweetTile(Tile):
         self.resultType = tile.get("resultType") or "mixed"
         self.language = tile.get("language") or "en"
         self.searches = tile.get("searches") or []
+        self.pool = TweetPool(self.title, self.searches, self.query, self.language, self.resultType,
+                              self.freshness,
+                              tile.get("poolSize") or 50,
+                              tile.get("poolTTL") or 3600,
+                              tile.get("poolLowWater") or 5)
         self.tweet = None
         self.renderSemaphore = Semaphore()
         random.seed()
-        self.tweepyAuth = tweepy.OAuthHandler(cfg["twitterAPIKey"],
-                                              cfg["twitterAPISecretKey"])
-        self.tweepyAPI = tweepy.API(self.tweepyAuth)
-        self.getANewTweet()
-        self.timer = RepeatTimer(cfg["twitterUpdateInterval"], self.getANewTweet)
-        self.timer.start()
+        # start with the tweet we showed last time, and get a new one in the background
+        self.snapshotKey = "RandomTweet:%s" % self.title
+        tweetJSON, savedAt = snapshots.load(self.snapshotKey)
+        if tweetJSON is not None:
+            try:
+                self.tweet = twitter.parse(tweetJSON)
+                self.hydrated(savedAt)
+            except Exception:
+                logging.warning("Couldn't restore tweet from snapshot", exc_info=True)
+        self.refreshJob = scheduler.every(cfg["twitterUpdateInterval"], self.getANewTweet,
+                                          name="RandomTweet:%s" % self.title,
+                                          jitter=cfg.get("refreshJitter") or 0.0,
+                                          key="twitter",
+                                          delay=0)
 
     def getANewTweet(self):
-        self.renderSemaphore.acquire()
+        # served from the candidate pool; the network is only involved (all
+        # the searches at once) when the pool has run dry. none of this
+        # holds the semaphore, so a slow query doesn't block a render.
         try:
-            self.tweet = None
-            # make a deep copy we can remove duds from
-            searches = list(self.searches)
-            while self.tweet == None:
-                # have we been through them all?
-                if len(searches) == 0:
-                    break
-                # get a random search from the list
-                search = random.choice(searches)
-                query = self.query % search
-                # get recent tweets for that search
-                tweets = []
-                searchResults = tweepy.Cursor(self.tweepyAPI.search,
-                                              q=query,
-                                              lang=self.language,
-                                              result_type=self.resultType,
-                                              include_entities=True,
-                                              count=self.freshness).items(self.freshness)
-                for tweet in searchResults:
-                    tweets.append(tweet)
-                if len(tweets) > 0:
-                    # pick a random tweet
-                    tweet = random.choice(tweets)
-                    logging.info("Picked tweet: https://twitter.com/%s/status/%s" %
-                                 (tweet.user.screen_name,
-                                  tweet.id_str))
-                    self.tweet = self.tweepyAPI.get_status(tweet.id)
-                else:
-                    # don't try that one again on this pass
-                    searches.remove(search)
-        except Exception as E:
-            logging.warning("Exception while running twitter query: %s" % query, exc_info=True)
+            tweetJSON = self.pool.take()
+            if tweetJSON is None:
+                self.pool.refill()
+                tweetJSON = self.pool.take()
+            newTweet = twitter.parse(tweetJSON) if tweetJSON is not None else None
+        except Exception:
+            logging.warning("Exception while refilling the tweet pool for %s", self.title, exc_info=True)
+            self.refreshFailed()
+            return
+        if newTweet is not None:
+            logging.info("Picked tweet: https://twitter.com/%s/status/%s" %
+                         (newTweet.user.screen_name,
+                          newTweet.id_str))
+        # normally the pool already fetched the profile photo; either way
+        # render never has to touch the network
+        if newTweet is not None and newTweet.author is not None:
+            imageCache.prefetch(newTweet.author.profile_image_url_https)
+        metrics.acquire(self.renderSemaphore, lock=type(self).__name__)
+        try:
+            self.tweet = newTweet
+            self.dataVersion += 1
         finally:
             self.renderSemaphore.release()
+        if newTweet is not None:
+            snapshots.save(self.snapshotKey, newTweet._json)
+        self.dataUpdated()
 
     def render(self):
         # TODO: account for entities like &amp;
         image = super().render()
         margin = 10  # padding at top and bottom of tile
         width, height = image.get_size()
-        self.renderSemaphore.acquire()
+        metrics.acquire(self.renderSemaphore, lock=type(self).__name__)
         try:
             if self.tweet is not None:
                 if self.tweet.is_quote_status:
@@ -92,14 +228,8 @@ class RandomTweetTile(Tile):
                 profilePhoto = None
                 authorTextImage = None
                 if author is not None:
-                    # profile photo
-                    try:
-                        resp = requests.get(self.tweet.author.profile_image_url_https)
-                        profilePhoto = pygame.image.load(BytesIO(resp.content))
-                    except Exception as e:
-                        logging.info("Exception pulling profile photo from %s" %
-                                     self.tweet.author.profile_image_url_https,
-                                     exc_info=True)
+                    # profile photo (prefetched by getANewTweet)
+                    profilePhoto = imageCache.get(author.profile_image_url_https)
                     # author name
                     authorText = "@" + author.screen_name + " (" + author.name + ")"
                     authorTextImage = super().renderText(authorText)
@@ -131,6 +261,7 @@ class RandomTweetTile(Tile):
                 text = self.title + "\n\n(Tweet not found)"
                 textImage = super().renderText(text)
                 image.blit(textImage, (margin, margin))
+            self.drawStatusIndicators(image)
             return image
         finally:
             self.renderSemaphore.release()
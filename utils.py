@@ -1,36 +1,169 @@
-from threading import Timer
+from collections import OrderedDict
+from threading import Lock
 import pygame
-
-
-fontsLoaded = {}
-
-
-class RepeatTimer(Timer):
-    # thanks, StackOverflow!
-    def __init__(self, interval, function):
-        super().__init__(interval, function)
-        self.daemon = True
-
-    def run(self):
-        while not self.finished.wait(self.interval):
-            self.function(*self.args, **self.kwargs)
+import configuration
+from assets import assets
 
 
 def getFont(fontName, fontSize):
-    if (fontName, fontSize) not in fontsLoaded:
-        fontsLoaded[(fontName, fontSize)] = pygame.font.Font("fonts/" + fontName + ".ttf",
-                                                             fontSize)
-    return fontsLoaded[(fontName, fontSize)]
+    return assets.font(fontName, fontSize)
+
+
+class ScaledSurfaceCache:
+    # bounded LRU of scaled copies of surfaces, keyed by the identity of the
+    # source (rendered tiles are never drawn on after the fact), the target
+    # size and the resize filter. animation frames (fast=True) come in sizes
+    # that hardly ever repeat, so they aren't cached at all: they're scaled
+    # into a scratch buffer that's only good until the next call, which is
+    # fine for placeTile since it blits straight away. buffers are
+    # allocated with their size rounded up to a multiple of bucketSize and
+    # drawn into through a subsurface, and buffers that aren't in use are
+    # kept in a free list (itself an LRU, so odd sizes age out) to be reused
+    # by the next miss of about the same size, so once the cache is warm
+    # scaling doesn't allocate.
+    def __init__(self, maxEntries, maxFreeBuffers=None, bucketSize=16):
+        self.maxEntries = maxEntries
+        self.maxFreeBuffers = maxFreeBuffers if maxFreeBuffers is not None else maxEntries
+        self.bucketSize = bucketSize
+        self.entries = OrderedDict()  # key -> (source, scaled surface, buffer)
+        self.freeBuffers = OrderedDict()  # bucketed size -> [buffer], least recently used first
+        self.freeCount = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.scratch = 0
+
+    def getScaled(self, source, size, fast=False):
+        with self.lock:
+            if fast:
+                self.scratch += 1
+                buffer, target = self.takeBuffer(size)
+                pygame.transform.scale(source, size, target)
+                # nobody else holds on to it, so it can go straight back
+                self.freeBuffer(buffer)
+                return target
+            key = (id(source), size, configuration.resizeFilter)
+            entry = self.entries.get(key)
+            # id()s can be reused once a source is freed, so check that the
+            # entry really belongs to this source
+            if entry is not None and entry[0] is source:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            buffer, target = self.takeBuffer(size)
+            pygame.transform.smoothscale(source, size, target)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.freeBuffer(old[2])
+            self.entries[key] = (source, target, buffer)
+            while len(self.entries) > self.maxEntries:
+                oldKey, (oldSource, oldTarget, oldBuffer) = self.entries.popitem(last=False)
+                self.freeBuffer(oldBuffer)
+            return target
+
+    def bucket(self, size):
+        return tuple(-(-length // self.bucketSize) * self.bucketSize for length in size)
+
+    def freeBuffer(self, buffer):
+        bucket = buffer.get_size()
+        self.freeBuffers.setdefault(bucket, []).append(buffer)
+        self.freeBuffers.move_to_end(bucket)
+        self.freeCount += 1
+        # drop the buffers of whatever size hasn't been wanted for longest
+        while self.freeCount > self.maxFreeBuffers:
+            oldBucket, buffers = next(iter(self.freeBuffers.items()))
+            buffers.pop(0)
+            if len(buffers) == 0:
+                del self.freeBuffers[oldBucket]
+            self.freeCount -= 1
+
+    def takeBuffer(self, size):
+        # returns (buffer, surface of exactly this size that draws into it)
+        bucket = self.bucket(size)
+        buffers = self.freeBuffers.get(bucket)
+        if buffers:
+            buffer = buffers.pop()
+            self.freeCount -= 1
+            if len(buffers) == 0:
+                del self.freeBuffers[bucket]
+        else:
+            buffer = pygame.Surface(bucket)
+        if bucket == tuple(size):
+            return buffer, buffer
+        return buffer, buffer.subsurface((0, 0) + tuple(size))
+
+    def clear(self):
+        # drop every cached copy (and with it the reference to its source)
+        with self.lock:
+            for source, target, buffer in self.entries.values():
+                self.freeBuffer(buffer)
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "freeBuffers": self.freeCount,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "scratch": self.scratch,
+                    "hitRate": (self.hits / lookups) if lookups > 0 else 0.0}
+
+
+scaledSurfaceCache = ScaledSurfaceCache(configuration.cfg.get("scaleCacheSize") or 64)
+
+
+def mipmapSizes(width, height, sizes=None, minSize=32):
+    # (width, height) of each level of a Mipmap of an image this size, largest first
+    if sizes is None:
+        sizes = set()
+        size = width // 2
+        while size >= minSize:
+            sizes.add(size)
+            size = size // 2
+        sizes.add(configuration.cfg["tileSizeSmall"])
+    levels = [(width, height)]
+    for size in sorted(sizes, reverse=True):
+        if size < width:
+            levels.append((size, int(height * size / width)))
+    return levels
+
+
+class Mipmap:
+    # a rendered tile plus a small pyramid of pre-scaled copies of it. the
+    # levels always include the small tile size, so the side tiles can be
+    # blitted without scaling, and animation frames scale down from the
+    # nearest larger level instead of the full-size image.
+    def __init__(self, base, sizes=None, minSize=32, levels=None):
+        self.base = base
+        if levels is not None:
+            # already scaled elsewhere (e.g. by a render process)
+            self.levels = levels
+            return
+        width, height = base.get_size()
+        self.levels = [base]
+        for size in mipmapSizes(width, height, sizes, minSize)[1:]:
+            self.levels.append(pygame.transform.smoothscale(base, size))
+
+    def levelFor(self, size):
+        # smallest level that's at least as big as the requested size
+        if size is None:
+            return self.base
+        best = self.base
+        for level in self.levels:
+            if level.get_width() >= size[0] and level.get_height() >= size[1]:
+                best = level
+            else:
+                break
+        return best
 
 
 def placeTile(source, target, size, loc, fast=False):
-    if size is not None:
-        resized = pygame.Surface(size)
-        if fast:
-            pygame.transform.scale(source, size, resized)
-        else:
-            pygame.transform.smoothscale(source, size, resized)
-        target.blit(resized, loc)
+    if isinstance(source, Mipmap):
+        source = source.levelFor(size)
+    if size is not None and size != source.get_size():
+        target.blit(scaledSurfaceCache.getScaled(source, size, fast), loc)
     else:
         target.blit(source, loc)
 
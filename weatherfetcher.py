@@ -0,0 +1,128 @@
+from threading import Lock
+import logging
+import configuration
+from datasource import openWeather
+from scheduler import scheduler
+from snapshot import snapshots
+
+cfg = configuration.cfg
+
+# the group endpoint takes at most this many city IDs per request
+groupSize = 20
+
+# snapshot keys for each endpoint's last good response for a city
+snapshotKeys = {"weather": "WeatherCurrent:%s",
+                "forecast": "WeatherForecast:%s"}
+
+
+class WeatherFetcher:
+    # fetches OpenWeather data once for every weather tile. tiles subscribe
+    # to an endpoint ("weather" or "forecast") for a city, with a received
+    # callback that's called with (data, changed) and a failed callback.
+    # current conditions for all subscribed cities come from group requests
+    # (up to groupSize cities each), and there's no group forecast endpoint,
+    # so forecasts are fetched once per city, however many tiles show it.
+    def __init__(self, interval, jitter=0.0):
+        self.interval = interval
+        self.jitter = jitter
+        self.lock = Lock()
+        self.subscribers = {"weather": {}, "forecast": {}}  # endpoint -> {cityID: [(received, failed)]}
+        self.latest = {}  # (endpoint, cityID) -> last good response
+        self.pending = {"weather": set(), "forecast": set()}  # cities not fetched yet
+        self.jobs = {}
+
+    def subscribe(self, endpoint, cityID, received, failed):
+        cityID = str(cityID)
+        with self.lock:
+            cities = self.subscribers[endpoint]
+            newCity = cityID not in cities
+            cities.setdefault(cityID, []).append((received, failed))
+            latest = self.latest.get((endpoint, cityID))
+            if newCity:
+                self.pending[endpoint].add(cityID)
+                if endpoint not in self.jobs:
+                    self.jobs[endpoint] = scheduler.every(self.interval,
+                                                          lambda: self.refresh(endpoint),
+                                                          name="OpenWeather:%s" % endpoint,
+                                                          jitter=self.jitter,
+                                                          key="openweather",
+                                                          delay=0)
+                elif len(self.pending[endpoint]) == 1:
+                    # a city that was added after the regular refresh already ran
+                    scheduler.once(0, lambda: self.refresh(endpoint, pendingOnly=True),
+                                   name="OpenWeather:%s:new" % endpoint,
+                                   key="openweather")
+        if latest is not None:
+            # another tile already has this city; share its data right away
+            self.deliver(endpoint, cityID, latest, True, [(received, failed)])
+
+    def loadSnapshot(self, endpoint, cityID):
+        # returns (payload, savedAt) or (None, None)
+        return snapshots.load(snapshotKeys[endpoint] % cityID)
+
+    def refresh(self, endpoint, pendingOnly=False):
+        with self.lock:
+            if pendingOnly:
+                cities = sorted(self.pending[endpoint])
+            else:
+                cities = sorted(self.subscribers[endpoint])
+            self.pending[endpoint].difference_update(cities)
+        if endpoint == "weather":
+            for i in range(0, len(cities), groupSize):
+                self.refreshGroup(cities[i:i + groupSize])
+        else:
+            for cityID in cities:
+                self.refreshCity(endpoint, cityID)
+
+    def refreshGroup(self, cities):
+        try:
+            group, changed = openWeather.query("group", {"id": ",".join(cities)})
+            responses = {str(weather["id"]): weather for weather in group["list"]}
+        except Exception:
+            logging.warning("Exception while running OpenWeather group query", exc_info=True)
+            for cityID in cities:
+                self.fail("weather", cityID)
+            return
+        for cityID in cities:
+            if cityID in responses:
+                self.update("weather", cityID, responses[cityID], changed)
+            else:
+                logging.warning("OpenWeather group query didn't return city %s", cityID)
+                self.fail("weather", cityID)
+
+    def refreshCity(self, endpoint, cityID):
+        try:
+            data, changed = openWeather.query(endpoint, {"id": cityID})
+        except Exception:
+            logging.warning("Exception while running OpenWeather %s query", endpoint, exc_info=True)
+            self.fail(endpoint, cityID)
+            return
+        self.update(endpoint, cityID, data, changed)
+
+    def update(self, endpoint, cityID, data, changed):
+        with self.lock:
+            self.latest[(endpoint, cityID)] = data
+            subscribers = list(self.subscribers[endpoint].get(cityID, []))
+        if changed:
+            snapshots.save(snapshotKeys[endpoint] % cityID, data)
+        self.deliver(endpoint, cityID, data, changed, subscribers)
+
+    def deliver(self, endpoint, cityID, data, changed, subscribers):
+        for received, failed in subscribers:
+            try:
+                received(data, changed)
+            except Exception:
+                # on any exception while parsing data, leave that tile's stale data
+                logging.warning("Exception while applying OpenWeather %s data for city %s",
+                                endpoint, cityID, exc_info=True)
+                failed()
+
+    def fail(self, endpoint, cityID):
+        with self.lock:
+            subscribers = list(self.subscribers[endpoint].get(cityID, []))
+        for received, failed in subscribers:
+            failed()
+
+
+weatherFetcher = WeatherFetcher(cfg["openWeatherUpdateInterval"],
+                                cfg.get("refreshJitter") or 0.0)
@@ -1,13 +1,19 @@
 import array
+import bisect
+import glob
+import logging
 import time
+from collections import Counter
 from datetime import date, datetime, timedelta
-import json
-from threading import Semaphore, Timer
+from threading import Semaphore
 import pygame
-import requests
 import configuration
 from tiles import Tile
-from utils import getFont, placeTile, tupleColor, getCPUTemp, RepeatTimer
+from weatherfetcher import weatherFetcher
+from assets import assets
+from metrics import metrics
+from textcache import fontLock
+from utils import getFont, placeTile, tupleColor, getCPUTemp
 
 cfg = configuration.cfg
 
@@ -23,55 +29,108 @@ def forceDayIcon(iconName):
     return iconName[0:len(iconName) - 1] + "d"
 
 
-def analyzeConditions(forecast, tonight):
-    # in the context of this method, "forecast" is the dict for a single day's forecast
-    # "tonight" is a flag to tell this method NOT to force a "day" icon
-    conditions = forecast.get("conditions")
-    # first look for precip
-    precip = False
-    for condition in conditions:
-        if condition <= 699:
-            precip = True
-            break
-    # now loop again to see which condition appears the most
-    forecast["condition"] = -1
-    forecast["icon"] = None
-    forecast["conditionName"] = "N/A"
-    conditionCount = 0
-    for i in range(len(conditions)):
-        condition = conditions[i]
-        if ((conditions.count(condition) > conditionCount) and
-                ((precip == False) or (condition <= 699))):
-            forecast["condition"] = condition
-            iconName = forecast.get("icons")[i]
-            # force a daytime icon unless we're specifically looking at the "tonight" forecast
-            if not tonight:
-                iconName = forceDayIcon(iconName)
-            forecast["icon"] = iconName
-            forecast["conditionName"] = forecast.get("conditionNames")[i]
-            conditionCount = conditions.count(condition)
+class ForecastColumns:
+    # forecast data points stored column-wise in compact typed arrays
+    # (timestamp, temperature, wind speed, condition ID) sorted by time, so
+    # a day is a contiguous slice found by bisecting the timestamps, and the
+    # per-day min/max and condition vote are reductions over slices instead
+    # of per-datum dict updates. icons and condition names aren't numeric
+    # and stay in lists indexed the same way.
+    def __init__(self, data):
+        data = sorted(data, key=lambda datum: datum["dt"])
+        self.timestamp = array.array("q", [datum["dt"] for datum in data])
+        self.temp = array.array("d", [datum["main"]["temp"] for datum in data])  # F
+        self.wind = array.array("d", [datum["wind"]["speed"] for datum in data])  # mph
+        self.condition = array.array("h", [datum["weather"][0]["id"] for datum in data])
+        self.icons = [datum["weather"][0]["icon"] for datum in data]
+        self.conditionNames = [datum["weather"][0]["main"] for datum in data]
+
+    def dayBounds(self, firstDay, days):
+        # (start, end) index of each day's slice, starting at local midnight of firstDay.
+        # anything before firstDay (e.g. in an old snapshot) falls outside every slice.
+        boundaries = [bisect.bisect_left(self.timestamp,
+                                         time.mktime((firstDay + timedelta(days=day)).timetuple()))
+                      for day in range(days + 1)]
+        return [(boundaries[day], boundaries[day + 1]) for day in range(days)]
+
+    def summarize(self, start, end, tonight):
+        # reduce one day's slice to a forecast dict; empty if there's no data.
+        # "tonight" is a flag to tell this method NOT to force a "day" icon
+        if start >= end:
+            return {}
+        temps = self.temp[start:end]
+        winds = self.wind[start:end]
+        conditions = self.condition[start:end]
+        # (arbitrary) rule for analyzing conditions:
+        # we use the code that appears the greatest number of times, BUT
+        # if any precipitation codes (<= 699) appear, then we ONLY count precip
+        # codes for that day. i.e., even if it only rains from 12:00pm - 3:00pm, that's
+        # still a rainy day. ties go to the code that appears first.
+        counts = Counter(conditions)
+        precip = Counter({condition: count for condition, count in counts.items() if condition <= 699})
+        condition = (precip or counts).most_common(1)[0][0]
+        first = start + conditions.index(condition)
+        iconName = self.icons[first]
+        # force a daytime icon unless we're specifically looking at the "tonight" forecast
+        if not tonight:
+            iconName = forceDayIcon(iconName)
+        return {"highTemp": max(temps),
+                "lowTemp": min(temps),
+                "highWind": max(winds),
+                "lowWind": min(winds),
+                "condition": condition,
+                "icon": iconName,
+                "conditionName": self.conditionNames[first]}
 
 
 class WeatherTile(Tile):
     def __init__(self, tile):
         super().__init__(tile)
         self.iconSize = tile.get("iconSize") or 75
-        self.icons = {}
+        # each tile can show its own location; the data is fetched by the
+        # shared weatherFetcher, once per city however many tiles show it
+        self.cityID = str(tile.get("cityID") or cfg["openWeatherCityID"])
+
+    def subscribe(self, endpoint, apply):
+        # start with whatever we had last time, and refresh in the background
+        weather, savedAt = weatherFetcher.loadSnapshot(endpoint, self.cityID)
+        if weather is not None:
+            try:
+                apply(weather)
+                self.hydrated(savedAt)
+            except Exception:
+                # e.g. saved by an older version; just wait for fresh data
+                logging.warning("Couldn't restore %s weather for city %s from snapshot",
+                                endpoint, self.cityID, exc_info=True)
+
+        def received(weather, changed):
+            if changed:
+                apply(weather)
+            self.dataUpdated()
+        weatherFetcher.subscribe(endpoint, self.cityID, received, self.refreshFailed)
+
+    @classmethod
+    def declareAssets(cls, tile):
+        # any of the condition icons might be needed
+        images, fonts = super().declareAssets(tile)
+        iconSize = tile.get("iconSize") or 75
+        for path in sorted(glob.glob("images/openweather/*@2x.png")):
+            images.append({"path": path, "size": (iconSize, iconSize), "alpha": True,
+                           "assetClass": "icon"})
+        return images, fonts
 
     def getIcon(self, name):
-        if name in self.icons:
-            return self.icons.get(name)
-        icon = pygame.transform.smoothscale(pygame.image.load("images/openweather/" + name + "@2x.png").convert_alpha(),
-                                            (self.iconSize, self.iconSize))
-        self.icons[name] = icon
-        return icon
+        return assets.image("images/openweather/" + name + "@2x.png", (self.iconSize, self.iconSize),
+                            alpha=True, assetClass="icon")
 
 
 class WeatherCurrentTile(WeatherTile):
     def __init__(self, tile):
         super().__init__(tile)
         # initialize data fields in case the first call to the service
-        # fails and they don't get filled in
+        # fails and they don't get filled in; until there's any data at
+        # all (weather is None) the tile says it's loading
+        self.weather = None
         self.tempF = 0.0
         self.feelsLike = 0.0
         self.humidity = 0.0
@@ -79,36 +138,27 @@ class WeatherCurrentTile(WeatherTile):
         self.windDirection = "N/A"
         self.condition = "Error"
         self.icon = None
-        self.serviceError = False
+        self.locale = ""
         self.renderSemaphore = Semaphore()
-        self.updateWeatherCurrent()
-        self.timer = RepeatTimer(cfg["openWeatherUpdateInterval"], self.updateWeatherCurrent)
-        self.timer.start()
+        self.subscribe("weather", self.applyWeatherCurrent)
 
-    def updateWeatherCurrent(self):
-        self.renderSemaphore.acquire()
+    def applyWeatherCurrent(self, weather):
+        metrics.acquire(self.renderSemaphore, lock=type(self).__name__)
         try:
-            resp = requests.get("https://api.openweathermap.org/data/2.5/weather?id=" +
-                                cfg["openWeatherCityID"] +
-                                "&APPID=" +
-                                cfg["openWeatherAPIKey"] +
-                                "&units=imperial")
-            self.weather = json.loads(resp.text)
-        except Exception:
-            # on any exception while fetching or parsing data,
-            # leave stale data but set a flag to show that it's stale
-            self.serviceError = True
-            logging.warning("Exception while running OpenWeather query", exc_info=True)
-        else:
-            self.tempF = self.weather["main"]["temp"]
-            self.feelsLike = self.weather["main"]["feels_like"]
-            self.humidity = self.weather["main"]["humidity"]
-            self.windSpeed = self.weather["wind"]["speed"]
-            self.windDirection = bearingToDir(self.weather["wind"]["deg"])
-            self.condition = self.weather["weather"][0]["main"]
-            self.icon = self.weather["weather"][0]["icon"]
-            self.locale = self.weather["name"]
-            self.serviceError = False
+            # read everything before changing anything, so bad data leaves
+            # the tile as it was
+            fields = (weather["main"]["temp"],
+                      weather["main"]["feels_like"],
+                      weather["main"]["humidity"],
+                      weather["wind"]["speed"],
+                      bearingToDir(weather["wind"]["deg"]),
+                      weather["weather"][0]["main"],
+                      weather["weather"][0]["icon"],
+                      weather["name"])
+            (self.tempF, self.feelsLike, self.humidity, self.windSpeed, self.windDirection,
+             self.condition, self.icon, self.locale) = fields
+            self.weather = weather
+            self.dataVersion += 1
         finally:
             self.renderSemaphore.release()
 
@@ -116,7 +166,7 @@ class WeatherCurrentTile(WeatherTile):
         image = super().render()
         margin = 10  # padding at top and bottom of tile
         width, height = image.get_size()
-        self.renderSemaphore.acquire()
+        metrics.acquire(self.renderSemaphore, lock=type(self).__name__)
         try:
             # top text
             topTextImage = super().renderText("%s Weather" % self.locale)
@@ -124,14 +174,17 @@ class WeatherCurrentTile(WeatherTile):
             image.blit(topTextImage, (int((width / 2) - (topWidth / 2)),
                                       margin))
             # bottom text
-            bottomText = ("%.0f F and %s\nHumidity: %.0f%%\n"
-                          "Feels like: %.0f F\nWind: %s at %.0f mph") % \
-                (self.tempF,
-                 self.condition,
-                 self.humidity,
-                 self.feelsLike,
-                 self.windDirection,
-                 self.windSpeed)
+            if self.weather is None:
+                bottomText = "Loading..."
+            else:
+                bottomText = ("%.0f F and %s\nHumidity: %.0f%%\n"
+                              "Feels like: %.0f F\nWind: %s at %.0f mph") % \
+                    (self.tempF,
+                     self.condition,
+                     self.humidity,
+                     self.feelsLike,
+                     self.windDirection,
+                     self.windSpeed)
             bottomTextImage = super().renderText(bottomText)
             bottomWidth, bottomHeight = bottomTextImage.get_size()
             image.blit(bottomTextImage, (int((width / 2) - (bottomWidth / 2)),
@@ -152,10 +205,7 @@ class WeatherCurrentTile(WeatherTile):
                                                 self.iconSize,
                                                 self.iconSize))
                 image.blit(self.getIcon(self.icon), (iconX, iconY))
-            # error indicator
-            if self.serviceError:
-                errorIndicator = super().renderText("X", color=tupleColor("#FF0000"))
-                image.blit(errorIndicator, (0, 0))
+            self.drawStatusIndicators(image)
             return image
         finally:
             self.renderSemaphore.release()
@@ -166,27 +216,21 @@ class WeatherForecastTile(WeatherTile):
         super().__init__(tile)
         self.fontSmall = getFont(self.fontName, 18)
         self.forecast = [{}, {}, {}, {}, {}, {}]
-        self.serviceError = False
+        self.forecastDay = date.today()
+        self.locale = ""
         self.renderSemaphore = Semaphore()
-        self.updateWeatherForecast()
-        self.timer = RepeatTimer(cfg["openWeatherUpdateInterval"], self.updateWeatherForecast)
-        self.timer.start()
+        self.subscribe("forecast", self.applyWeatherForecast)
+
+    @classmethod
+    def declareAssets(cls, tile):
+        images, fonts = super().declareAssets(tile)
+        fonts.append((tile.get("font") or "Ubuntu-Regular", 18))
+        return images, fonts
 
-    def updateWeatherForecast(self):
-        self.renderSemaphore.acquire()
+    def applyWeatherForecast(self, weather):
+        metrics.acquire(self.renderSemaphore, lock=type(self).__name__)
         try:
-            resp = requests.get("https://api.openweathermap.org/data/2.5/forecast?id=" +
-                                cfg["openWeatherCityID"] +
-                                "&APPID=" +
-                                cfg["openWeatherAPIKey"] +
-                                "&units=imperial")
-            self.weather = json.loads(resp.text)
-        except Exception:
-            # on any exception while fetching or parsing data,
-            # leave stale data but set a flag to show that it's stale
-            self.serviceError = True
-            logging.warning("Exception while running OpenWeather query", exc_info=True)
-        else:
+            self.weather = weather
             # the return should contain 5 days of data points, 3 hours apart.
             # bin them up by day, and try to distill the bins into today (day 0), tomorrow
             # (day 1), etc. forecasts.
@@ -196,45 +240,31 @@ class WeatherForecastTile(WeatherTile):
             # call in the morning) or it might start with tomorrow and go through five
             # days from now (if we call in the evening). We handle both cases by making
             # the forecast a six-element array here and throwing out the empty day later.
-            forecast = [{}, {}, {}, {}, {}, {}]
 
             # for each day we're just looking for a high, a low, a range of windspeeds,
             # and a general condition for the day.
             self.forecastDay = date.today()
-            for datum in self.weather.get("list"):
-                # figure out what day this datum is for
-                delta = date.fromtimestamp(datum.get("dt")) - self.forecastDay
-                day = delta.days
-                if day <= 5:
-                    self.collectDatum(forecast[day], datum)
-
-            # (arbitrary) rule for analyzing conditions:
-            # we use the code that appears the greatest number of times, BUT
-            # if any precipitation codes (<= 699) appear, then we ONLY count precip
-            # codes for that day. i.e., even if it only rains from 12:00pm - 3:00pm, that's
-            # still a rainy day.
-            for day in range(len(forecast)):
-                conditions = forecast[day].get("conditions")
-                if conditions is None:
-                    continue
-                # check to see if this is a "tonight" forecast;
-                # collect
-                if (day == 0) and (time.localtime().tm_hour >= 12):
-                    tonight = True
-                else:
-                    tonight = False
-                analyzeConditions(forecast[day], tonight)
+            columns = ForecastColumns(self.weather.get("list"))
+            forecast = []
+            for day, (start, end) in enumerate(columns.dayBounds(self.forecastDay, 6)):
+                # check to see if this is a "tonight" forecast
+                tonight = (day == 0) and (time.localtime().tm_hour >= 12)
+                forecast.append(columns.summarize(start, end, tonight))
             self.forecast = forecast
             self.locale = self.weather.get("city").get("name")
-            self.serviceError = False
+            self.dataVersion += 1
         finally:
             self.renderSemaphore.release()
 
+    def renderKey(self):
+        # the day names ("Today"/"Tonight", weekdays) change with the clock
+        return super().renderKey() + (date.today(), time.localtime().tm_hour >= 12)
+
     def render(self):
         image = super().render()
         margin = 10  # padding at top and bottom of tile and between columns
         width, height = image.get_size()
-        self.renderSemaphore.acquire()
+        metrics.acquire(self.renderSemaphore, lock=type(self).__name__)
         try:
             # top text
             topTextImage = super().renderText("%s Forecast" % self.locale)
@@ -273,49 +303,24 @@ class WeatherForecastTile(WeatherTile):
             # start slapping them up there
             iconOffset = int((columnWidth - self.iconSize) / 2)  # this is an X offset only
             for day in range(5):
-                pygame.draw.ellipse(image,
-                                    tupleColor("#B0B0FF"),
-                                    pygame.Rect(x[day] + iconOffset,
-                                                y[day],
-                                                self.iconSize,
-                                                self.iconSize))
                 # have to apply offset to icon lookup since it's looking back to the "old" array
-                image.blit(self.getIcon(self.forecast[day + offset]["icon"]),
-                           (x[day] + iconOffset, y[day]))
+                # (and there's no icon for a day we have no data for yet)
+                icon = self.forecast[day + offset].get("icon")
+                if icon is not None:
+                    pygame.draw.ellipse(image,
+                                        tupleColor("#B0B0FF"),
+                                        pygame.Rect(x[day] + iconOffset,
+                                                    y[day],
+                                                    self.iconSize,
+                                                    self.iconSize))
+                    image.blit(self.getIcon(icon), (x[day] + iconOffset, y[day]))
                 forecastTextImage = super().renderText(forecastStrings[day], font=self.fontSmall)
                 image.blit(forecastTextImage, (x[day], int(y[day] + self.iconSize + (margin / 2))))
-            # error indicator
-            if self.serviceError:
-                errorIndicator = super().renderText("X", color=tupleColor("#FF0000"))
-                image.blit(errorIndicator, (0, 0))
+            self.drawStatusIndicators(image)
             return image
         finally:
             self.renderSemaphore.release()
 
-    def collectDatum(self, forecast, datum):
-        # in the context of this method, "forecast" is the dict for a single day's forecast
-        # handle temperature
-        temp = datum.get("main").get("temp")  # float, F
-        if "highTemp" not in forecast or temp > forecast.get("highTemp"):
-            forecast["highTemp"] = temp
-        if "lowTemp" not in forecast or temp < forecast.get("lowTemp"):
-            forecast["lowTemp"] = temp
-        # handle wind speed
-        wind = datum.get("wind").get("speed")  # float, mph
-        if "highWind" not in forecast or wind > forecast.get("highWind"):
-            forecast["highWind"] = wind
-        if "lowWind" not in forecast or wind < forecast.get("lowWind"):
-            forecast["lowWind"] = wind
-        # handle condition data by saving them in a list to be analyzed later
-        if "conditions" not in forecast:
-            # initialize the lists on first use
-            forecast["conditions"] = []
-            forecast["icons"] = []
-            forecast["conditionNames"] = []
-        forecast["conditions"].append(datum.get("weather")[0].get("id"))
-        forecast["icons"].append(datum.get("weather")[0].get("icon"))
-        forecast["conditionNames"].append(datum.get("weather")[0].get("main"))
-
     def buildForecastStrings(self, offset):
         # build a list of forecast strings so we can size them and center vertically
         forecastStrings = []
@@ -331,6 +336,9 @@ class WeatherForecastTile(WeatherTile):
                 dayName = "Tomorrow"
             else:
                 dayName = (self.forecastDay + timedelta(days=day)).strftime("%A")
+            if len(self.forecast[day]) == 0:
+                forecastStrings.append("%s:\nN/A" % dayName)
+                continue
             forecastString = ("%s:\nHigh: %.0f F\nLow: %.0f F\nWind: %.0f-%.0f mph\n%s" %
                               (dayName,
                                self.forecast[day]["highTemp"],
@@ -339,7 +347,8 @@ class WeatherForecastTile(WeatherTile):
                                self.forecast[day]["highWind"],
                                self.forecast[day]["conditionName"]))
             forecastStrings.append(forecastString)
-            width, height = font = self.fontSmall.size(forecastString)
+            with fontLock:
+                width, height = font = self.fontSmall.size(forecastString)
             if height > maxHeight:
                 maxHeight = height
         return forecastStrings, maxHeight